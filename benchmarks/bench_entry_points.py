@@ -0,0 +1,208 @@
+"""
+Benchmarks the MedAssist entry points against the offline InMemoryBackend.
+
+Synthetic patients are generated from the real test names and ranges in
+data/blood_test_analysis.xlsx. For every entry point the harness reports throughput,
+p50/p95/p99 latency, backend reads per call and the process peak RSS, writes the
+numbers as JSON and can compare them against a stored baseline. --stages adds the
+per-stage timings and event counts from the instrumentation sink:
+
+    python benchmarks/bench_entry_points.py --users 50 --points 8 --output bench.json
+    python benchmarks/bench_entry_points.py --baseline bench.json
+
+The exit status is 1 when any entry point is slower than the baseline by more than
+--tolerance (p50 latency or throughput).
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def run_case(name, calls, backend, before_call=None):
+    """
+    Times every call in `calls` (zero-argument callables) and returns its statistics.
+    """
+    latencies = []
+    reads_before = backend.reads
+    started = time.perf_counter()
+    for call in calls:
+        if before_call is not None:
+            before_call()
+        t0 = time.perf_counter()
+        call()
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        "Calls": count,
+        "Throughput (calls/s)": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50 (ms)": round(percentile(latencies, 50) * 1000, 3),
+        "p95 (ms)": round(percentile(latencies, 95) * 1000, 3),
+        "p99 (ms)": round(percentile(latencies, 99) * 1000, 3),
+        "Backend Reads / Call": round((backend.reads - reads_before) / count, 2) if count else 0.0,
+        "Peak RSS (MB)": round(peak_rss_mb(), 1),
+    }
+
+
+def run_benchmarks(args):
+    import matplotlib
+    matplotlib.use("Agg")
+
+    import medassist
+    from medassist import history, instrumentation
+
+    backend = medassist.set_backend(medassist.InMemoryBackend.from_xlsx())
+    user_ids = backend.add_synthetic_users(args.users, args.points, n_tests=args.tests, seed=args.seed)
+    medassist.reference_store.refresh()
+
+    rng = random.Random(args.seed)
+    latest = {}
+    for user_id in user_ids:
+        latest[user_id] = history.build_user_history(user_id, backend.stream_test_results(user_id)).latest_values()
+    if args.mirror:
+        # Returning patients: the mirror is synced once, calls then only ask for newer results
+        from medassist.mirror import LocalMirror, set_mirror
+        mirror = set_mirror(LocalMirror(os.path.join(tempfile.mkdtemp(prefix="medassist-bench-"), "mirror.db")))
+        for user_id in user_ids:
+            mirror.sync(user_id)
+    backend.reads = 0
+
+    pairs = [(name, value) for values in latest.values() for name, value in values.items()]
+    rng.shuffle(pairs)
+    pairs = pairs[:args.classify_calls]
+
+    # Without --warm each call starts from an empty history cache, as a new request would
+    reset = None if args.warm else history.invalidate_user_history
+    report_users = user_ids[:args.report_users]
+
+    classify = medassist.classify_test_result
+    report = medassist.generate_medical_report_from_firestore
+    cases = [
+        ("classify_test_result", [lambda p=p: classify(*p, plot=False) for p in pairs], None),
+        ("classify_test_result (plot)", [lambda p=p: classify(*p) for p in pairs[:args.plot_calls]], None),
+        ("calculate_risk_score", [lambda u=u: medassist.calculate_risk_score(latest[u]) for u in user_ids], None),
+        ("extract_unique_care_guides", [lambda u=u: medassist.extract_unique_care_guides(latest[u]) for u in user_ids], None),
+        ("analyze_trend_from_firestore", [lambda u=u: medassist.analyze_trend_from_firestore(u) for u in user_ids], reset),
+        ("predict_all_next_values_from_firestore", [lambda u=u: medassist.predict_all_next_values_from_firestore(u) for u in user_ids], reset),
+        ("generate_medical_report_from_firestore", [lambda u=u: report(u, use_cache=False) for u in report_users], reset),
+        # Unchanged patients: the first round fills the report cache, the rest are served from it
+        ("generate_medical_report_from_firestore (cached)", [lambda u=u: report(u) for u in report_users * 5], None),
+    ]
+
+    results = {}
+    stages = {}
+    for name, calls, before_call in cases:
+        if args.only and name not in args.only:
+            continue
+        collector = instrumentation.set_metrics_sink(instrumentation.CollectorSink()) if args.stages else None
+        results[name] = run_case(name, calls, backend, before_call)
+        if collector is not None:
+            instrumentation.set_metrics_sink(None)
+            stages[name] = {"Stages": collector.summary(), "Events": dict(collector.counts)}
+        print(f"{name:42s} {results[name]['Throughput (calls/s)']:>10.1f}/s  "
+              f"p50 {results[name]['p50 (ms)']:>9.3f} ms  p95 {results[name]['p95 (ms)']:>9.3f} ms  "
+              f"p99 {results[name]['p99 (ms)']:>9.3f} ms  reads/call {results[name]['Backend Reads / Call']}")
+
+    return {
+        "Config": {
+            "Users": args.users,
+            "Tests": args.tests or len(backend.catalogue),
+            "Points Per Test": args.points,
+            "Seed": args.seed,
+            "Warm": args.warm,
+            "Mirror": args.mirror,
+            "Python": platform.python_version(),
+            "Platform": platform.platform(),
+        },
+        "Results": results,
+        "Stages": stages,
+        "Peak RSS (MB)": round(peak_rss_mb(), 1),
+    }
+
+
+def compare_to_baseline(current, baseline, tolerance):
+    """
+    Prints the change of every entry point against the baseline and returns the names
+    of the ones that regressed by more than `tolerance` (a fraction).
+    """
+    regressions = []
+    for name, result in current["Results"].items():
+        base = baseline.get("Results", {}).get(name)
+        if not base:
+            continue
+        p50_change = (result["p50 (ms)"] - base["p50 (ms)"]) / base["p50 (ms)"] if base["p50 (ms)"] else 0.0
+        rate_change = ((result["Throughput (calls/s)"] - base["Throughput (calls/s)"]) / base["Throughput (calls/s)"]
+                       if base["Throughput (calls/s)"] else 0.0)
+        regressed = p50_change > tolerance or rate_change < -tolerance
+        print(f"{name:42s} p50 {p50_change:+7.1%}  throughput {rate_change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50, help="number of synthetic users")
+    parser.add_argument("--tests", type=int, default=None, help="tests per user (default: whole catalogue)")
+    parser.add_argument("--points", type=int, default=8, help="historical results per test")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--classify-calls", type=int, default=2000, help="calls for classify_test_result")
+    parser.add_argument("--plot-calls", type=int, default=20, help="calls for classify_test_result with plotting")
+    parser.add_argument("--report-users", type=int, default=5, help="users to generate PDF reports for")
+    parser.add_argument("--warm", action="store_true", help="keep the user history cache between calls")
+    parser.add_argument("--mirror", action="store_true", help="read histories through a pre-synced local SQLite mirror")
+    parser.add_argument("--stages", action="store_true", help="also collect per-stage timings and event counts")
+    parser.add_argument("--only", nargs="*", help="entry point names to run")
+    parser.add_argument("--output", help="write results as JSON to this path")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown vs the baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    print(f"Peak RSS: {results['Peak RSS (MB)']} MB")
+    for name, collected in results["Stages"].items():
+        print(f"\n{name}")
+        for stage, summary in collected["Stages"].items():
+            print(f"  {stage:20s} {summary['Calls']:>7d} calls  {summary['Mean (ms)']:>10.3f} ms mean")
+        for event, total in collected["Events"].items():
+            print(f"  {event:20s} {total:>7d}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare_to_baseline(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
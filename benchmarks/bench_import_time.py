@@ -0,0 +1,65 @@
+"""
+Guards the cold-start cost of the classification API.
+
+Each run imports the classification entry points in a fresh interpreter and records how
+long the import took and which heavy dependencies it pulled in. The exit status is 1 if
+the median import time exceeds --max-ms or if any of NumPy, pandas, matplotlib,
+ReportLab, scikit-learn or FastAPI was loaded:
+
+    python benchmarks/bench_import_time.py --runs 20 --max-ms 100
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["numpy", "pandas", "matplotlib", "reportlab", "sklearn", "fastapi", "firebase_admin"]
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from medassist import calculate_risk_score, classify_test_result, extract_unique_care_guides
+elapsed = time.perf_counter() - started
+print(json.dumps({"ms": elapsed * 1000, "heavy": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def measure(runs):
+    samples = []
+    heavy = set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", PROBE], cwd=REPO_ROOT, check=True,
+                                capture_output=True, text=True).stdout
+        result = json.loads(output)
+        samples.append(result["ms"])
+        heavy.update(result["heavy"])
+    return samples, sorted(heavy)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="fresh interpreters to start")
+    parser.add_argument("--max-ms", type=float, default=100.0, help="allowed median import time")
+    args = parser.parse_args(argv)
+
+    samples, heavy = measure(args.runs)
+    median = statistics.median(samples)
+    print(f"classification API import: median {median:.1f} ms, min {min(samples):.1f} ms, max {max(samples):.1f} ms")
+
+    failed = False
+    if median > args.max_ms:
+        print(f"FAIL: median import time {median:.1f} ms exceeds {args.max_ms:.1f} ms")
+        failed = True
+    if heavy:
+        print(f"FAIL: heavy modules imported eagerly: {', '.join(heavy)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""
+Checks that `classify_test_results_batch` agrees with the scalar classification.
+
+For every test of the catalogue in data/blood_test_analysis.xlsx, values at, just inside
+and just outside both bounds, far outside the range and invalid inputs (NaN, infinities,
+text, None) are classified with `classify_against_reference` and with the batch function.
+The labels and the time-to-normal estimates must match; the exit status is 1 otherwise:
+
+    python benchmarks/check_batch_classification.py
+"""
+
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+INVALID_VALUES = [float("nan"), "nan", float("inf"), "-inf", "abc", "", None]
+
+
+def probe_values(min_range, max_range):
+    width = max_range - min_range
+    step = width * 1e-3 or 1e-3
+    return [min_range, max_range, min_range - step, max_range + step, min_range + step, max_range - step,
+            (min_range + max_range) / 2, min_range - 10 * width - 1, max_range + 10 * width + 1, str(max_range + step)]
+
+
+def main():
+    import medassist
+    from medassist.analysis import TIME_TO_NORMAL_HIGH, TIME_TO_NORMAL_LOW, classify_against_reference, format_duration
+
+    medassist.set_backend(medassist.InMemoryBackend.from_xlsx())
+    store = medassist.reference_store
+    store.refresh()
+
+    names, values = [], []
+    for test_name in store.test_names():
+        test_range = store.get_range(test_name)
+        probes = probe_values(*test_range) if test_range is not None else [1.0]
+        for value in probes + INVALID_VALUES:
+            names.append(test_name)
+            values.append(value)
+
+    batch = medassist.classify_test_results_batch(names, values)
+    mismatches = 0
+    for i, (test_name, value) in enumerate(zip(names, values)):
+        result, _ = classify_against_reference(test_name, value, store.get(test_name), store.get_range(test_name), plot=False)
+        expected = result.get("Result")
+        days = int(batch["Estimated Days"][i])
+        expected_time = None
+        if days >= 0:
+            template = TIME_TO_NORMAL_LOW if batch["Result"][i] == "Low" else TIME_TO_NORMAL_HIGH
+            expected_time = template.format(time=format_duration(days))
+        if batch["Result"][i] != expected or (expected_time is not None and
+                                              result.get("Time to Reach Normal Range") != expected_time):
+            mismatches += 1
+            print(f"MISMATCH {test_name} {value!r}: scalar {expected} / {result.get('Time to Reach Normal Range')}, "
+                  f"batch {batch['Result'][i]} / {days} days")
+
+    print(f"{len(values)} values over {len(set(names))} tests, {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+Checks that demographic reference ranges are selected the same way for every spelling of sex.
+
+The catalogue of data/blood_test_analysis.xlsx is loaded with male and female Hemoglobin bands
+added. Each spelling ("M", "Male", "male", " man ", ...) must select the band of its sex in
+`get_range`, `classify_test_result` and `calculate_risk_score`; unknown values fall back to the
+bands for any sex. The exit status is 1 on a mismatch. The lookup time is printed as well:
+
+    python benchmarks/check_demographic_ranges.py
+"""
+
+import os
+import sys
+import timeit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+BANDS = [
+    {"sex": "male", "min_age": 18, "max_age": None, "min_range": 13.5, "max_range": 17.5},
+    {"sex": "female", "min_age": 18, "max_age": None, "min_range": 12.0, "max_range": 15.5},
+    {"sex": "any", "min_age": 0, "max_age": 18, "min_range": 11.0, "max_range": 16.0},
+]
+
+SPELLINGS = {
+    "male": ["male", "Male", "MALE", "M", "m", " man "],
+    "female": ["female", "Female", "F", "f", "Woman"],
+    None: [None, "", "other", 1],
+}
+
+
+def main():
+    import medassist
+    from medassist.reference import reference_store
+
+    backend = medassist.InMemoryBackend.from_xlsx()
+    catalogue = backend.get_reference_catalogue()
+    catalogue["Hemoglobin"] = dict(catalogue["Hemoglobin"], demographic_ranges=BANDS)
+    medassist.set_backend(backend)
+    reference_store.install(catalogue)
+
+    expected_ranges = {"male": (13.5, 17.5), "female": (12.0, 15.5), None: reference_store.get_range("Hemoglobin")}
+    mismatches = 0
+    for sex, spellings in SPELLINGS.items():
+        expected = expected_ranges[sex]
+        # 13.0 is Low for men only, 15.8 is High for women only
+        expected_labels = [("Low" if expected[0] > value else "High" if value > expected[1] else "Normal")
+                           for value in (13.0, 15.8)]
+        for spelling in spellings:
+            test_range = reference_store.get_range("Hemoglobin", 30, spelling)
+            labels = [medassist.classify_test_result("Hemoglobin", value, plot=False, age=30, sex=spelling)[0]["Result"]
+                      for value in (13.0, 15.8)]
+            score = medassist.calculate_risk_score({"Hemoglobin": 13.0}, 30, spelling)["Total Abnormal Results"]
+            if test_range != expected or labels != expected_labels or score != int(expected_labels[0] != "Normal"):
+                mismatches += 1
+                print(f"MISMATCH sex={spelling!r}: range {test_range}, labels {labels}, abnormal {score}; "
+                      f"expected {expected}, {expected_labels}")
+
+    runs = 200000
+    for spelling in ("male", "M", None):
+        seconds = min(timeit.repeat(lambda: reference_store.get_range("Hemoglobin", 30, spelling), number=runs, repeat=5))
+        print(f"get_range(age=30, sex={spelling!r}): {seconds / runs * 1e6:.2f} us per lookup")
+
+    print(f"{sum(len(spellings) for spellings in SPELLINGS.values())} spellings checked, {mismatches} mismatches")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
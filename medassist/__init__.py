@@ -0,0 +1,91 @@
+"""
+MedAssist blood test analysis.
+
+Public functions are re-exported here but imported on first use, so `import medassist`
+stays cheap: NumPy/pandas load only with the history, trend and prediction code,
+matplotlib only when `classify_test_result` draws a PNG chart, and ReportLab only for PDF reports.
+"""
+
+_EXPORTS = {
+    # Classification and scores
+    "classify_test_result": "analysis",
+    "classify_against_reference": "analysis",
+    "classify_test_results_batch": "analysis",
+    "render_test_result_plot": "analysis",
+    "calculate_risk_score": "analysis",
+    "extract_unique_care_guides": "analysis",
+    # Reports
+    "classify_tests_for_report": "report",
+    "generate_medical_report_from_firestore": "report",
+    "iter_report_chunks": "report",
+    "ReportCache": "report_cache",
+    "report_cache_key": "report_cache",
+    "get_report_cache": "report_cache",
+    "set_report_cache": "report_cache",
+    "generate_cohort_reports": "cohort",
+    "build_translation_cache": "translation",
+    "get_report_text": "translation",
+    "ReportText": "translation",
+    # Monitoring and prediction
+    "analyze_trend_from_firestore": "monitoring",
+    "analyze_trend_population": "monitoring",
+    "trend_features_batch": "monitoring",
+    "predict_all_next_values_from_firestore": "prediction",
+    "forecast_series_batch": "prediction",
+    "forecast_population": "prediction",
+    "run_population_analytics": "population",
+    "aggregate_shard": "population",
+    "PopulationStats": "population",
+    "QuantileSketch": "population",
+    # Incremental trend state
+    "record_test_result": "trend_state",
+    "rebuild_trend_state": "trend_state",
+    "analyze_trend_from_state": "trend_state",
+    "predict_all_next_values_from_state": "trend_state",
+    # Ingestion
+    "ingest_lab_results": "ingest",
+    "parse_lab_report_text": "ingest",
+    "build_alias_index": "ingest",
+    "get_alias_index": "ingest",
+    # Data access
+    "load_user_history": "history",
+    "invalidate_user_history": "history",
+    "UserHistory": "history",
+    "LocalMirror": "mirror",
+    "get_mirror": "mirror",
+    "set_mirror": "mirror",
+    "reference_store": "reference",
+    "ReferenceStore": "reference",
+    "StorageBackend": "backend",
+    "FirestoreBackend": "backend",
+    "InMemoryBackend": "backend",
+    "get_backend": "backend",
+    "set_backend": "backend",
+    "AsyncStorageBackend": "async_backend",
+    "AsyncFirestoreBackend": "async_backend",
+    "ThreadedAsyncBackend": "async_backend",
+    # HTTP service
+    "create_app": "service",
+    "AnalysisService": "service",
+    # Instrumentation
+    "set_metrics_sink": "instrumentation",
+    "LoggingSink": "instrumentation",
+    "PrometheusSink": "instrumentation",
+    "CollectorSink": "instrumentation",
+}
+
+__all__ = sorted(_EXPORTS)
+
+
+def __getattr__(name):
+    module_name = _EXPORTS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+    value = getattr(import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
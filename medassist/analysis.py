@@ -0,0 +1,390 @@
+# AI-Powered Medical Test Analysis
+
+import io
+import math
+import threading
+from collections import OrderedDict
+
+from .instrumentation import count_event, timed, warn
+from .reference import reference_store
+
+
+# Templated report sentences (also expanded by `translation` for the translated reports)
+TIME_TO_NORMAL_LOW = "With proper management, levels may normalize in approximately {time}."
+TIME_TO_NORMAL_HIGH = "If the current trend continues, value may stabilize within {time}."
+HEALTH_MESSAGE_GOOD = "Your health score is {score}%, indicating good health. Keep monitoring periodically."
+HEALTH_MESSAGE_FOLLOW_UP = "Your health score is {score}%, which indicates you should follow up with your healthcare provider."
+HEALTH_MESSAGE_CRITICAL = "Your health score is {score}%, indicating a critical health risk. Immediate medical attention is advised."
+
+
+def classify_test_result(test_name, test_value, plot=True, age=None, sex=None):
+    """
+    Classifies a test result and generates a plot.
+    Test reference data comes from the cached Firestore catalogue (`reference_store`);
+    pass the patient's `age` and `sex` to use age/sex-dependent ranges where the test has them.
+    The plot is returned as an in-memory PNG (`io.BytesIO`); pass plot=False when only
+    the result dict is needed, the plot is then None.
+    """
+
+    # Step 1: Retrieve reference data
+    test_info = reference_store.get(test_name)
+    if test_info is None:
+        return {"Message": "Test not found in Firestore."}, None
+
+    return classify_against_reference(test_name, test_value, test_info,
+                                      reference_store.get_range(test_name, age, sex), plot)
+
+
+def classify_against_reference(test_name, test_value, test_info, test_range, plot=True):
+    """
+    Classifies a test result against reference data that has already been looked up.
+    Does not read Firestore, so it can run in worker processes.
+
+    Parameters:
+    test_name (str): Name of the test.
+    test_value: Test value (number or numeric string).
+    test_info (dict): Reference document of the test.
+    test_range (tuple): Parsed (min_range, max_range), or None if the range is invalid.
+    plot (bool): Whether to render the range chart.
+
+    Returns:
+    tuple: (result dict, PNG buffer or None), as returned by `classify_test_result`.
+    """
+
+    # Step 2: Safely extract and convert values
+    try:
+        test_value = float(test_value)
+    except (ValueError, TypeError):
+        test_range = None
+    else:
+        # NaN compares False with both bounds and would read as Normal
+        if not math.isfinite(test_value):
+            test_range = None
+    if test_range is None:
+        return {"Message": "Invalid test or range values."}, None
+    min_range, max_range = test_range
+
+    health_info = test_info.get("health_information", "No additional health information available.")
+
+    # Step 3: Determine result
+    if test_value < min_range:
+        result = "Low"
+        indication = test_info.get("low_values_indicate", "Low values may indicate an issue.")
+        recommendation = test_info.get("treatment_guide", "Consult a doctor for further evaluation.")
+    elif test_value > max_range:
+        result = "High"
+        indication = test_info.get("high_values_indicate", "High values may indicate an issue.")
+        recommendation = test_info.get("treatment_guide", "Consult a doctor for further evaluation.")
+    else:
+        result = "Normal"
+        indication = "Within healthy range."
+        recommendation = "No treatment required."
+
+    # Time-to-Normal Estimation
+    time_to_normal = "Test result is within the normal range."
+    if result in ["Low", "High"]:
+        midpoint = (min_range + max_range) / 2
+        deviation = abs(test_value - midpoint)
+        normal_range_width = max_range - min_range
+        daily_change_rate = 0.015 * normal_range_width
+
+        if daily_change_rate > 0:
+            estimated_days = int(deviation / daily_change_rate)
+            estimated_days = max(estimated_days, 3)
+            time_text = format_duration(estimated_days)
+            if result == "Low":
+                time_to_normal = TIME_TO_NORMAL_LOW.format(time=time_text)
+            else:
+                time_to_normal = TIME_TO_NORMAL_HIGH.format(time=time_text)
+        else:
+            time_to_normal = "Unable to estimate time-to-normal due to insufficient data."
+
+    # Re-test recommendation
+    if result == "Normal":
+        re_test_recommendation = "No immediate concern, retest in 90 days."
+    elif result in ["Low", "High"]:
+        re_test_recommendation = "Trending poorly — retest in 14 days."
+    else:
+        re_test_recommendation = "Critical — immediate consultation advised."
+
+    # Prepare result dictionary
+    result_data = {
+        "Test Name": test_name,
+        "Result": result,
+        "Possible Diseases": indication,
+        "Treatment Guide": recommendation,
+        "Doctor Specialization": (
+            test_info.get("high_doctor_specialization_to_visit", "General Physician") if result == "High" else
+            test_info.get("low_doctor_specialization_to_visit", "General Physician")
+        ),
+        "Time to Reach Normal Range": time_to_normal,
+        "Next Recommended Test Date": re_test_recommendation,
+        "Health Information": health_info
+    }
+
+    # Plotting (only when the caller needs the chart)
+    plot_png = render_test_result_plot(test_name, test_value, min_range, max_range) if plot else None
+
+    return result_data, plot_png
+
+
+def format_duration(days):
+    """
+    Returns a number of days as the duration text of the time-to-normal sentence
+    ("20 days", "1 month and 5 days"; months count 30 days).
+    """
+    if days >= 30:
+        months = days // 30
+        days = days % 30
+        return f"{months} month{'s' if months > 1 else ''}" + (f" and {days} days" if days > 0 else "")
+    return f"{days} day{'s' if days > 1 else ''}"
+
+
+
+# Result Plot Rendering
+
+# Number of rendered charts (PNG bytes) kept in memory
+PLOT_CACHE_SIZE = 512
+
+_plot_cache = OrderedDict()
+_plot_cache_lock = threading.Lock()
+plot_cache_stats = {"Rendered": 0, "Cached": 0}
+
+
+def render_test_result_plot(test_name, test_value, min_range, max_range):
+    """
+    Renders the range chart of one test result and returns it as an in-memory PNG (`io.BytesIO`).
+
+    Charts are keyed by (test, value, min_range, max_range), so an
+    identical chart is rendered once and then served from a bounded in-memory LRU cache.
+    Nothing is written to disk, and every call gets its own buffer, so concurrent reports
+    never share a file or a read position. Uses the object-oriented Figure API, so it does
+    not touch pyplot's global state and is safe to call from threads.
+    """
+    key = (test_name, float(test_value), float(min_range), float(max_range))
+
+    with _plot_cache_lock:
+        png = _plot_cache.get(key)
+        if png is not None:
+            _plot_cache.move_to_end(key)
+
+    if png is not None:
+        plot_cache_stats["Cached"] += 1
+        count_event("plots_cached")
+    else:
+        with timed("plot_render"):
+            png = _draw_test_result_plot(test_name, test_value, min_range, max_range)
+        plot_cache_stats["Rendered"] += 1
+        count_event("plots_rendered")
+        with _plot_cache_lock:
+            _plot_cache[key] = png
+            while len(_plot_cache) > PLOT_CACHE_SIZE:
+                _plot_cache.popitem(last=False)
+
+    return io.BytesIO(png)
+
+
+def _draw_test_result_plot(test_name, test_value, min_range, max_range):
+    from matplotlib.figure import Figure
+
+    value_color = "red" if test_value < min_range or test_value > max_range else "dodgerblue"
+
+    buffer = (max_range - min_range) * 0.5 if max_range != min_range else abs(min_range) * 0.5
+    x_min = min(min_range - buffer, test_value - buffer)
+    x_max = max(max_range + buffer, test_value + buffer)
+
+    fig = Figure(figsize=(9, 5))
+    ax = fig.add_subplot()
+    if test_value < min_range:
+        ax.axvspan(x_min, min_range, color='salmon', alpha=0.3, label='Below Normal Range')
+    else:
+        ax.axvspan(x_min, min_range, color='white', alpha=0.3)
+    if test_value > max_range:
+        ax.axvspan(max_range, x_max, color='salmon', alpha=0.3, label='Above Normal Range')
+    else:
+        ax.axvspan(max_range, x_max, color='white', alpha=0.3)
+    ax.axvspan(min_range, max_range, color='skyblue', alpha=0.3, label='Normal Range')
+    ax.axvline(min_range, color='dodgerblue', linestyle='--', label='Min Range', lw=2)
+    ax.axvline(max_range, color='royalblue', linestyle='--', label='Max Range', lw=2)
+    ax.scatter(test_value, 0, color=value_color, s=250, marker='o', edgecolors='black', label="Your Test Value")
+    ax.annotate(f"Your value: {test_value}",
+                xy=(test_value, 0),
+                xytext=(test_value, 0.07),
+                fontsize=12,
+                color=value_color,
+                arrowprops=dict(facecolor=value_color, arrowstyle="->", lw=2))
+    ax.set_xlim(x_min, x_max)
+    ax.set_xlabel("Test Value", fontsize=13, color='black')
+    ax.set_ylabel("Indicator", fontsize=13, color='black')
+    ax.set_title(f"{test_name} Test Result", fontsize=15, color='black')
+    ax.legend()
+    ax.grid(True, linestyle='--', alpha=0.5)
+
+    # Encode the plot in memory
+    png_buffer = io.BytesIO()
+    fig.savefig(png_buffer, bbox_inches='tight', format='png')
+    return png_buffer.getvalue()
+
+
+
+
+# Batch Classification
+
+def classify_test_results_batch(test_names, test_values):
+    """
+    Vectorized version of `classify_test_result` for large imports of lab results.
+    Uses the same rules and the cached reference ranges, but never renders a plot.
+
+    Parameters:
+    test_names (array-like): Test name of each result.
+    test_values (array-like): Test value of each result (numbers or numeric strings).
+
+    Returns:
+    dict: Arrays aligned with the input rows:
+        "Result": "Low" / "Normal" / "High", or None if the test is unknown or the value/range is invalid
+        (non-numeric, NaN or infinite values, as in `classify_against_reference`).
+        "Estimated Days": Estimated days to reach the normal range (-1 if normal or not estimable).
+        "Retest Days": Days until the recommended retest (90 if normal, 14 if abnormal, -1 if invalid).
+        "Risk Points": Contribution to the risk score (0 normal, 1 low, 2 high, 0 if invalid).
+    """
+    import numpy as np
+    import pandas as pd
+
+    test_index, min_table, max_table = reference_store.range_table()
+
+    rows = test_index.get_indexer(pd.Index(test_names))
+    values = pd.to_numeric(pd.Series(test_values, dtype=object), errors="coerce").to_numpy(dtype=float)
+    if len(rows) != len(values):
+        raise ValueError("test_names and test_values must have the same length.")
+
+    known = rows >= 0
+    min_range = np.where(known, min_table[rows], np.nan)
+    max_range = np.where(known, max_table[rows], np.nan)
+    valid = known & ~np.isnan(min_range) & ~np.isnan(max_range) & np.isfinite(values)
+
+    low = valid & (values < min_range)
+    high = valid & (values > max_range)
+    abnormal = low | high
+
+    # 0 = Low, 1 = Normal, 2 = High, 3 = invalid
+    codes = np.where(low, 0, np.where(high, 2, 1))
+    codes[~valid] = 3
+
+    # Time-to-Normal Estimation (same formula as classify_test_result)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        midpoint = (min_range + max_range) / 2
+        daily_change_rate = 0.015 * (max_range - min_range)
+        raw_days = np.abs(values - midpoint) / daily_change_rate
+    estimable = abnormal & (daily_change_rate > 0)
+    estimated_days = np.full(len(values), -1, dtype=np.int64)
+    estimated_days[estimable] = np.maximum(np.floor(raw_days[estimable]), 3).astype(np.int64)
+
+    retest_days = np.where(abnormal, 14, 90)
+    retest_days[~valid] = -1
+
+    return {
+        "Result": np.array(["Low", "Normal", "High", None], dtype=object)[codes],
+        "Estimated Days": estimated_days,
+        "Retest Days": retest_days,
+        "Risk Points": np.where(low, 1, np.where(high, 2, 0)),
+    }
+
+
+
+
+# Health Score Calculation
+
+def calculate_risk_score(test_results, age=None, sex=None):
+    """
+    Calculates a health risk score based on multiple test results using Firestore data
+    and provides a user-friendly summary.
+
+    Parameters:
+    test_results (dict): A dictionary with test names as keys and test values as values.
+    age (float): Patient age, for age-dependent reference ranges (optional).
+    sex (str): Patient sex ("male" / "female", or an alias such as "M"), for sex-dependent reference ranges (optional).
+
+    Returns:
+    dict: A summary with total abnormal count, health score, health status, and user message.
+    """
+    total_score = 0
+    max_possible_score = len(test_results) * 2
+    abnormal_count = 0
+
+    for test_name, test_value in test_results.items():
+        # Convert test_value to float if possible
+        try:
+            test_value = float(test_value)
+        except (ValueError, TypeError):
+            continue  # Skip invalid test values
+
+        # Retrieve reference range from the cached catalogue
+        test_range = reference_store.get_range(test_name, age, sex)
+        if test_range is None:
+            continue  # Skip if test not found or range is not defined
+
+        min_range, max_range = test_range
+
+        # Score calculation
+        if test_value < min_range:
+            total_score += 1
+            abnormal_count += 1
+        elif test_value > max_range:
+            total_score += 2
+            abnormal_count += 1
+        else:
+            total_score += 0
+
+    # Risk and Health Score Calculation
+    risk_score = (total_score / max_possible_score) * 100 if max_possible_score > 0 else 0
+    health_score = round(100 - risk_score, 2)
+
+    # Natural Language Summary
+    health_status, message = health_summary(health_score)
+
+    return {
+        "Total Abnormal Results": abnormal_count,
+        "Health Score": f"{health_score}%",
+        "Health Status": health_status,
+        "Health Summary Message": message
+    }
+
+
+def health_summary(health_score):
+    """
+    Returns the (health status, summary message) of a health score.
+    """
+    if health_score >= 80:
+        return "Low Risk (Healthy)", HEALTH_MESSAGE_GOOD.format(score=health_score)
+    if health_score >= 50:
+        return "Moderate Risk (Needs Attention)", HEALTH_MESSAGE_FOLLOW_UP.format(score=health_score)
+    return "High Risk (Critical Condition)", HEALTH_MESSAGE_CRITICAL.format(score=health_score)
+
+
+
+
+# Care Guide
+
+def extract_unique_care_guides(test_results):
+    """
+    Extracts unique care guides from Firestore based on the test results.
+
+    Parameters:
+    test_results (dict): A dictionary with test names as keys and test values as values.
+
+    Returns:
+    list: A list of unique care guides.
+    """
+    unique_care_guides = set()
+
+    for test_name in test_results.keys():
+        # Retrieve test document from the cached catalogue
+        data = reference_store.get(test_name)
+        if data is not None:
+            care_guide = data.get("care_guide")
+            if care_guide:  # Add only non-empty care guides
+                unique_care_guides.add(care_guide)
+        else:
+            warn(f"Test '{test_name}' not found in Firestore.", once=True)
+
+    return list(unique_care_guides)
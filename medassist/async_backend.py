@@ -0,0 +1,90 @@
+# Async Storage Backend
+
+import asyncio
+
+
+class AsyncStorageBackend:
+    """
+    Async counterpart of `StorageBackend` for the read paths of the HTTP service.
+    Implementations must allow several reads to be awaited concurrently.
+    """
+
+    async def get_reference_catalogue(self):
+        """Returns {test name: reference dict} for the whole catalogue."""
+        raise NotImplementedError
+
+    async def get_user(self, user_id):
+        """Returns the user profile dict, or None if the user does not exist."""
+        raise NotImplementedError
+
+    async def get_test_results(self, user_id):
+        """Returns the list of the user's test result dicts that have a value."""
+        raise NotImplementedError
+
+
+class AsyncFirestoreBackend(AsyncStorageBackend):
+    """
+    Backend on Firestore's native asyncio client (the default firebase_admin app's if none is given).
+    """
+
+    def __init__(self, client=None):
+        self._client = client
+        self.reads = 0
+
+    @property
+    def client(self):
+        if self._client is None:
+            from firebase_admin import firestore_async
+            self._client = firestore_async.client()
+        return self._client
+
+    async def get_reference_catalogue(self):
+        catalogue = {}
+        async for doc in self.client.collection("blood_tests").stream():
+            catalogue[doc.id] = doc.to_dict() or {}
+            self.reads += 1
+        return catalogue
+
+    async def get_user(self, user_id):
+        doc = await self.client.collection("users").document(user_id).get()
+        self.reads += 1
+        return doc.to_dict() if doc.exists else None
+
+    async def get_test_results(self, user_id):
+        query = self.client.collection("users").document(user_id).collection("test_results")
+        records = []
+        async for doc in query.where("value", "!=", None).stream():
+            records.append(doc.to_dict())
+        self.reads += len(records)
+        return records
+
+
+class ThreadedAsyncBackend(AsyncStorageBackend):
+    """
+    Runs the calls of a synchronous `StorageBackend` on worker threads, so blocking
+    clients (or the in-memory backend) can serve the async service without stalling the event loop.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def get_reference_catalogue(self):
+        return await asyncio.to_thread(self.backend.get_reference_catalogue)
+
+    async def get_user(self, user_id):
+        return await asyncio.to_thread(self.backend.get_user, user_id)
+
+    async def get_test_results(self, user_id):
+        return await asyncio.to_thread(lambda: list(self.backend.stream_test_results(user_id)))
+
+
+def async_backend_for(backend):
+    """
+    Returns the async backend matching a synchronous one: Firestore's asyncio client
+    for `FirestoreBackend` without an explicit client, a thread adapter otherwise.
+    """
+    from .backend import FirestoreBackend
+
+    if isinstance(backend, FirestoreBackend) and backend.uses_default_client:
+        return AsyncFirestoreBackend()
+    return ThreadedAsyncBackend(backend)
@@ -0,0 +1,449 @@
+# Storage Backend
+
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from .instrumentation import warn
+
+
+REFERENCE_XLSX_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                   "data", "blood_test_analysis.xlsx")
+TREND_STATE_COLLECTION = "trend_state"
+FIRESTORE_BATCH_LIMIT = 500  # writes per WriteBatch commit
+DEMOGRAPHIC_RANGES_SHEET = "Demographic Ranges"
+
+
+class StorageBackend:
+    """
+    Data access used by the analysis functions: the `blood_tests` reference catalogue,
+    the user profile, the per-user `test_results` history and the per-test trend state.
+
+    `reads` counts documents read from the backend, so load tests can report round-trips.
+    """
+
+    def __init__(self):
+        self.reads = 0
+
+    def get_reference_catalogue(self):
+        """Returns {test name: reference dict} for the whole catalogue."""
+        raise NotImplementedError
+
+    def watch_reference_catalogue(self, callback):
+        """
+        Calls callback(catalogue) whenever the catalogue changes.
+        Returns an object with an unsubscribe() method.
+        """
+        raise NotImplementedError
+
+    def get_user(self, user_id):
+        """Returns the user profile dict, or None if the user does not exist."""
+        raise NotImplementedError
+
+    def get_users(self, user_ids):
+        """Returns {user ID: profile dict or None} for several users."""
+        return {user_id: self.get_user(user_id) for user_id in user_ids}
+
+    def stream_user_ids(self, page_size=500):
+        """Yields the ID of every user, reading `page_size` users per query."""
+        raise NotImplementedError
+
+    def stream_test_results(self, user_id):
+        """Yields the user's test result dicts (test_name, value, date) that have a value."""
+        raise NotImplementedError
+
+    def stream_test_result_changes(self, user_id, since=None):
+        """
+        Yields (document ID, test result dict) for the user's results that have a value and were
+        created after `since` (a timezone-aware `created_at` datetime), or for all of them if since is None.
+        Results without a `created_at` field are only returned when since is None.
+        """
+        raise NotImplementedError
+
+    def stream_all_test_results(self, shard=0, shards=1):
+        """
+        Yields (user ID, test result dict) for every result with a value across all users, in one
+        pass. Results are split into `shards` disjoint parts that can be read in parallel; within a
+        part the results of a user are contiguous, but a user may continue in the next part.
+        """
+        raise NotImplementedError
+
+    def add_test_result(self, user_id, result, update_state):
+        """
+        Stores a test result dict and atomically replaces the trend state of its test with
+        update_state(current state or None). Returns the new state.
+        """
+        raise NotImplementedError
+
+    def add_test_results(self, rows):
+        """
+        Stores many test result dicts, given as (user ID, result) pairs, with bulk writes.
+        Trend states are not updated (see `rebuild_trend_state`).
+        """
+        raise NotImplementedError
+
+    def get_trend_states(self, user_id):
+        """Returns {test name: trend state} for the user."""
+        raise NotImplementedError
+
+    def set_trend_states(self, user_id, states):
+        """Overwrites the trend state of the given tests."""
+        raise NotImplementedError
+
+
+class FirestoreBackend(StorageBackend):
+    """
+    Backend on a Firestore client (the default firebase_admin app's client if none is given).
+    """
+
+    def __init__(self, client=None):
+        super().__init__()
+        self._client = client
+        self.uses_default_client = client is None
+
+    @property
+    def client(self):
+        if self._client is None:
+            from firebase_admin import firestore
+            self._client = firestore.client()
+        return self._client
+
+    def _user_ref(self, user_id):
+        return self.client.collection("users").document(user_id)
+
+    def get_reference_catalogue(self):
+        catalogue = {}
+        for doc in self.client.collection("blood_tests").stream():
+            catalogue[doc.id] = doc.to_dict() or {}
+            self.reads += 1
+        return catalogue
+
+    def watch_reference_catalogue(self, callback):
+        def on_change(col_snapshot, changes, read_time):
+            callback({doc.id: doc.to_dict() or {} for doc in col_snapshot})
+
+        return self.client.collection("blood_tests").on_snapshot(on_change)
+
+    def get_user(self, user_id):
+        doc = self._user_ref(user_id).get()
+        self.reads += 1
+        return doc.to_dict() if doc.exists else None
+
+    def get_users(self, user_ids):
+        users = dict.fromkeys(user_ids)
+        for doc in self.client.get_all([self._user_ref(user_id) for user_id in users]):
+            self.reads += 1
+            if doc.exists:
+                users[doc.id] = doc.to_dict()
+        return users
+
+    def stream_user_ids(self, page_size=500):
+        # Pages ordered by document ID; select() with no fields skips the profile data
+        query = self.client.collection("users").select([]).order_by("__name__").limit(page_size)
+        last_doc = None
+        while True:
+            page = list((query.start_after(last_doc) if last_doc is not None else query).stream())
+            self.reads += len(page)
+            for doc in page:
+                yield doc.id
+            if len(page) < page_size:
+                return
+            last_doc = page[-1]
+
+    def stream_test_results(self, user_id):
+        test_docs = self._user_ref(user_id).collection("test_results").where("value", "!=", None).stream()
+        for doc in test_docs:
+            self.reads += 1
+            yield doc.to_dict()
+
+    def stream_test_result_changes(self, user_id, since=None):
+        query = self._user_ref(user_id).collection("test_results")
+        if since is None:
+            query = query.where("value", "!=", None)
+        else:
+            # A single inequality per query: results without a value are dropped here
+            query = query.where("created_at", ">", since).order_by("created_at")
+        for doc in query.stream():
+            self.reads += 1
+            data = doc.to_dict()
+            if data.get("value") is not None:
+                yield doc.id, data
+
+    def stream_all_test_results(self, shard=0, shards=1):
+        # Collection group query over users/*/test_results, ordered by document path so a
+        # user's results are contiguous; shards are Firestore query partitions
+        query = self.client.collection_group("test_results")
+        if shards > 1:
+            partitions = list(query.get_partitions(shards))
+            if shard >= len(partitions):
+                return
+            query = partitions[shard].query()
+        else:
+            query = query.order_by("__name__")
+        for doc in query.stream():
+            self.reads += 1
+            data = doc.to_dict()
+            if data.get("value") is not None:
+                yield doc.reference.parent.parent.id, data
+
+    def add_test_result(self, user_id, result, update_state):
+        from firebase_admin import firestore
+
+        user_ref = self._user_ref(user_id)
+        result_ref = user_ref.collection("test_results").document()
+        state_ref = user_ref.collection(TREND_STATE_COLLECTION).document(result["test_name"])
+
+        @firestore.transactional
+        def apply(transaction):
+            snapshot = state_ref.get(transaction=transaction)
+            self.reads += 1
+            state = update_state(snapshot.to_dict() if snapshot.exists else None)
+            transaction.set(result_ref, {**result, "created_at": firestore.SERVER_TIMESTAMP})
+            transaction.set(state_ref, state)
+            return state
+
+        return apply(self.client.transaction())
+
+    def add_test_results(self, rows):
+        from firebase_admin import firestore
+
+        for start in range(0, len(rows), FIRESTORE_BATCH_LIMIT):
+            batch = self.client.batch()
+            for user_id, result in rows[start:start + FIRESTORE_BATCH_LIMIT]:
+                result_ref = self._user_ref(user_id).collection("test_results").document()
+                batch.set(result_ref, {**result, "created_at": firestore.SERVER_TIMESTAMP})
+            batch.commit()
+
+    def get_trend_states(self, user_id):
+        states = {}
+        for doc in self._user_ref(user_id).collection(TREND_STATE_COLLECTION).stream():
+            states[doc.id] = doc.to_dict()
+            self.reads += 1
+        return states
+
+    def set_trend_states(self, user_id, states):
+        state_ref = self._user_ref(user_id).collection(TREND_STATE_COLLECTION)
+        batch = self.client.batch()
+        for test_name, state in states.items():
+            batch.set(state_ref.document(test_name), state)
+        batch.commit()
+
+
+class InMemoryBackend(StorageBackend):
+    """
+    Process-local backend for offline runs, tests and load tests. Holds plain dicts and
+    never touches the network; seed it with `from_xlsx` and `add_synthetic_users`.
+    """
+
+    def __init__(self, catalogue=None):
+        super().__init__()
+        self._lock = threading.Lock()
+        self.catalogue = dict(catalogue or {})
+        self.users = {}
+        self.test_results = {}
+        self.trend_states = {}
+        self._watchers = []
+
+    @classmethod
+    def from_xlsx(cls, path=REFERENCE_XLSX_PATH):
+        """
+        Creates a backend whose reference catalogue is read from the blood test workbook.
+        Column names map to the Firestore field names ("Min Range" -> "min_range").
+        """
+        return cls(load_reference_catalogue_xlsx(path))
+
+    def get_reference_catalogue(self):
+        self.reads += len(self.catalogue)
+        return {name: dict(data) for name, data in self.catalogue.items()}
+
+    def set_reference(self, test_name, test_info):
+        """Adds or replaces a reference document and notifies watchers."""
+        with self._lock:
+            self.catalogue[test_name] = dict(test_info)
+            watchers = list(self._watchers)
+        for callback in watchers:
+            callback({name: dict(data) for name, data in self.catalogue.items()})
+
+    def watch_reference_catalogue(self, callback):
+        backend = self
+
+        class _Watch:
+            def unsubscribe(self):
+                with backend._lock:
+                    if callback in backend._watchers:
+                        backend._watchers.remove(callback)
+
+        with self._lock:
+            self._watchers.append(callback)
+        return _Watch()
+
+    def add_user(self, user_id, user_data):
+        with self._lock:
+            self.users[user_id] = dict(user_data)
+            self.test_results.setdefault(user_id, [])
+
+    def get_user(self, user_id):
+        self.reads += 1
+        user_data = self.users.get(user_id)
+        return dict(user_data) if user_data is not None else None
+
+    def stream_user_ids(self, page_size=500):
+        with self._lock:
+            user_ids = list(self.users)
+        for user_id in user_ids:
+            self.reads += 1
+            yield user_id
+
+    def stream_test_results(self, user_id):
+        with self._lock:
+            records = list(self.test_results.get(user_id, ()))
+        for record in records:
+            if record.get("value") is not None:
+                self.reads += 1
+                yield dict(record)
+
+    def stream_test_result_changes(self, user_id, since=None):
+        # Results are append-only, so the list position serves as the document ID
+        with self._lock:
+            records = list(self.test_results.get(user_id, ()))
+        for i, record in enumerate(records):
+            if record.get("value") is None:
+                continue
+            if since is not None and (record.get("created_at") is None or record["created_at"] <= since):
+                continue
+            self.reads += 1
+            yield str(i), dict(record)
+
+    def stream_all_test_results(self, shard=0, shards=1):
+        with self._lock:
+            user_ids = sorted(self.test_results)
+        size = -(-len(user_ids) // shards) if user_ids else 0
+        for user_id in user_ids[shard * size:(shard + 1) * size]:
+            for record in self.stream_test_results(user_id):
+                yield user_id, record
+
+    def add_test_result(self, user_id, result, update_state):
+        with self._lock:
+            state_map = self.trend_states.setdefault(user_id, {})
+            state = update_state(state_map.get(result["test_name"]))
+            self.test_results.setdefault(user_id, []).append({**result, "created_at": datetime.now(timezone.utc)})
+            state_map[result["test_name"]] = state
+            self.reads += 1
+        return state
+
+    def add_test_results(self, rows):
+        created_at = datetime.now(timezone.utc)
+        with self._lock:
+            for user_id, result in rows:
+                self.test_results.setdefault(user_id, []).append({**result, "created_at": created_at})
+
+    def get_trend_states(self, user_id):
+        states = dict(self.trend_states.get(user_id, {}))
+        self.reads += len(states)
+        return states
+
+    def set_trend_states(self, user_id, states):
+        with self._lock:
+            self.trend_states.setdefault(user_id, {}).update(states)
+
+    def add_synthetic_users(self, n_users, points_per_test, n_tests=None, seed=0, start_date=datetime(2023, 1, 1)):
+        """
+        Adds reproducible synthetic patients. Each user gets `points_per_test` results for
+        `n_tests` catalogue tests (all by default), spread 20-90 days apart with non-negative values
+        drawn around the reference range, so some results fall outside it.
+
+        Returns:
+        list: The new user IDs.
+        """
+        import random
+
+        from .reference import _parse_range
+
+        rng = random.Random(seed)
+        tests = [(name, _parse_range(data)) for name, data in self.catalogue.items()]
+        tests = [(name, test_range) for name, test_range in tests if test_range is not None]
+        if n_tests is not None:
+            tests = tests[:n_tests]
+
+        user_ids = []
+        offset = len(self.users)
+        for i in range(n_users):
+            user_id = f"user_{offset + i:06d}"
+            self.add_user(user_id, {"username": f"Patient {offset + i}", "age": rng.randint(18, 90)})
+            records = []
+            for test_name, (min_range, max_range) in tests:
+                width = (max_range - min_range) or max(abs(min_range), 1.0)
+                date = start_date + timedelta(days=rng.randint(0, 60))
+                for _ in range(points_per_test):
+                    value = max(rng.gauss((min_range + max_range) / 2, width * 0.45), 0.0)
+                    records.append({"test_name": test_name, "value": round(value, 2), "date": date.strftime("%Y-%m-%d")})
+                    date += timedelta(days=rng.randint(20, 90))
+            rng.shuffle(records)
+            self.test_results[user_id] = records
+            user_ids.append(user_id)
+        return user_ids
+
+
+def load_reference_catalogue_xlsx(path=REFERENCE_XLSX_PATH):
+    """
+    Reads the blood test workbook into {test name: reference dict} with Firestore field names.
+    An optional "Demographic Ranges" sheet (Test, Sex, Min Age, Max Age, Min Range, Max Range)
+    becomes the `demographic_ranges` rows of its tests.
+    """
+    import pandas as pd
+
+    sheets = pd.read_excel(path, sheet_name=None)
+    df = next(iter(sheets.values()))
+    catalogue = {}
+    for row in df.to_dict(orient="records"):
+        test_name = str(row.pop("Test")).strip()
+        catalogue[test_name] = {
+            column.strip().lower().replace(" ", "_"): (None if pd.isna(value) else value)
+            for column, value in row.items()
+        }
+
+    demographic = sheets.get(DEMOGRAPHIC_RANGES_SHEET)
+    if demographic is not None:
+        for row in demographic.to_dict(orient="records"):
+            test_name = str(row.pop("Test")).strip()
+            if test_name not in catalogue:
+                warn(f"Demographic range for unknown test '{test_name}' ignored.", once=True)
+                continue
+            catalogue[test_name].setdefault("demographic_ranges", []).append({
+                column.strip().lower().replace(" ", "_"): (None if pd.isna(value) else value)
+                for column, value in row.items()
+            })
+    return catalogue
+
+
+_backend = None
+
+
+def get_backend():
+    """
+    Returns the active storage backend (Firestore unless set_backend was called).
+    """
+    global _backend
+    if _backend is None:
+        _backend = FirestoreBackend()
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Switches every analysis function to another storage backend and drops the caches
+    that were filled from the previous one.
+    """
+    from .history import invalidate_user_history
+    from .mirror import get_mirror
+    from .reference import reference_store
+
+    global _backend
+    _backend = backend
+    reference_store.unwatch()
+    reference_store.invalidate()
+    invalidate_user_history()
+    mirror = get_mirror()
+    if mirror is not None:
+        mirror.clear()
+    return backend
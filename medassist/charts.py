@@ -0,0 +1,110 @@
+# Vector Charts for PDF Reports
+
+from reportlab.graphics.shapes import Circle, Drawing, Line, Rect, String
+from reportlab.lib import colors
+
+
+CHART_WIDTH = 400
+CHART_HEIGHT = 110
+GROUP_PANEL_HEIGHT = 62
+
+# Light tints of the matplotlib chart colors (salmon / sky blue at 30% over white)
+_OUT_OF_RANGE_FILL = colors.HexColor("#fdd9d4")
+_NORMAL_RANGE_FILL = colors.HexColor("#d9eff9")
+_GRID_COLOR = colors.HexColor("#dddddd")
+
+
+def _chart_bounds(test_value, min_range, max_range):
+    # Same x limits as the matplotlib chart: the range padded by half its width
+    buffer = (max_range - min_range) * 0.5 if max_range != min_range else abs(min_range) * 0.5
+    x_min = min(min_range - buffer, test_value - buffer)
+    x_max = max(max_range + buffer, test_value + buffer)
+    if x_max <= x_min:
+        x_min, x_max = x_min - 1.0, x_max + 1.0
+    return x_min, x_max
+
+
+def _format_value(value):
+    return f"{value:g}"
+
+
+def _draw_range_panel(drawing, x, y, width, height, title, test_value, min_range, max_range):
+    """
+    Draws one range chart into `drawing` with its lower left corner at (x, y):
+    the title, the below/normal/above bands, dashed min/max lines and the value marker.
+    """
+    x_min, x_max = _chart_bounds(test_value, min_range, max_range)
+    scale = width / (x_max - x_min)
+
+    def to_x(value):
+        return x + (value - x_min) * scale
+
+    out_of_range = test_value < min_range or test_value > max_range
+    value_color = colors.red if out_of_range else colors.dodgerblue
+
+    band_y = y + 14
+    band_height = height - 34
+    drawing.add(String(x, y + height - 12, title, fontName="Helvetica-Bold", fontSize=10))
+
+    # Range bands (below range, normal range, above range)
+    min_x, max_x = to_x(min_range), to_x(max_range)
+    below_fill = _OUT_OF_RANGE_FILL if test_value < min_range else colors.white
+    above_fill = _OUT_OF_RANGE_FILL if test_value > max_range else colors.white
+    drawing.add(Rect(x, band_y, min_x - x, band_height, fillColor=below_fill, strokeColor=None))
+    drawing.add(Rect(min_x, band_y, max_x - min_x, band_height, fillColor=_NORMAL_RANGE_FILL, strokeColor=None))
+    drawing.add(Rect(max_x, band_y, x + width - max_x, band_height, fillColor=above_fill, strokeColor=None))
+    drawing.add(Rect(x, band_y, width, band_height, fillColor=None, strokeColor=_GRID_COLOR, strokeWidth=0.5))
+
+    # Min / max lines with their values under the axis
+    for bound, color in ((min_range, colors.dodgerblue), (max_range, colors.royalblue)):
+        bound_x = to_x(bound)
+        drawing.add(Line(bound_x, band_y, bound_x, band_y + band_height,
+                         strokeColor=color, strokeWidth=1.2, strokeDashArray=[3, 2]))
+        drawing.add(String(bound_x, y + 3, _format_value(bound), fontName="Helvetica", fontSize=7,
+                           fillColor=color, textAnchor="middle"))
+
+    # Value marker and label
+    value_x = to_x(test_value)
+    marker_y = band_y + band_height / 2
+    drawing.add(Circle(value_x, marker_y, 5, fillColor=value_color, strokeColor=colors.black, strokeWidth=0.6))
+    label = f"Your value: {_format_value(test_value)}"
+    anchor = "start" if value_x < x + width * 0.25 else "end" if value_x > x + width * 0.75 else "middle"
+    drawing.add(String(value_x, marker_y + 8, label, fontName="Helvetica", fontSize=8,
+                       fillColor=value_color, textAnchor=anchor))
+
+
+def test_result_drawing(test_name, test_value, min_range, max_range, width=CHART_WIDTH, height=CHART_HEIGHT):
+    """
+    Returns the range chart of one test result as a ReportLab vector Drawing.
+
+    Parameters:
+    test_name (str): Name of the test (used in the title).
+    test_value (float): The patient's value.
+    min_range, max_range (float): Reference range.
+
+    Returns:
+    Drawing: A flowable that can be added to a report story directly.
+    """
+    drawing = Drawing(width, height)
+    _draw_range_panel(drawing, 0, 0, width, height, f"{test_name} Test Result",
+                      float(test_value), float(min_range), float(max_range))
+    return drawing
+
+
+def grouped_result_drawing(panels, width=CHART_WIDTH, panel_height=GROUP_PANEL_HEIGHT):
+    """
+    Returns one compact Drawing with a range chart per test stacked top to bottom,
+    used for the differential pairs (absolute count and percentage) of the report.
+
+    Parameters:
+    panels (list): (test_name, test_value, min_range, max_range) tuples, top panel first.
+
+    Returns:
+    Drawing: A flowable holding every panel.
+    """
+    drawing = Drawing(width, panel_height * len(panels))
+    for i, (test_name, test_value, min_range, max_range) in enumerate(panels):
+        y = panel_height * (len(panels) - 1 - i)
+        _draw_range_panel(drawing, 0, y, width, panel_height - 4, test_name,
+                          float(test_value), float(min_range), float(max_range))
+    return drawing
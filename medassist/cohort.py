@@ -0,0 +1,355 @@
+# Bulk Cohort Reports
+
+import json
+import os
+import queue
+import re
+import shutil
+import threading
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pickle import PicklingError
+
+from .backend import get_backend
+from .history import build_user_history, fetch_test_records
+from .instrumentation import count_event, timed, warn
+from .reference import reference_store
+from .report import generate_medical_report_from_firestore
+
+
+COHORT_PAGE_SIZE = 100          # users fetched per page (profiles in one batch read)
+COHORT_PREFETCH_PAGES = 2       # fetched pages waiting for the workers
+COHORT_FETCH_THREADS = 8        # concurrent history queries within a page
+COHORT_PROGRESS_SECONDS = 10
+MANIFEST_NAME = "manifest.jsonl"
+
+
+def report_filename(user_id):
+    """
+    Returns the file name of a user's report inside the output directory or archive.
+    """
+    return f"medical_report_{re.sub(r'[^A-Za-z0-9_.-]', '_', str(user_id))}.pdf"
+
+
+def _iter_pages(user_ids, page_size):
+    page = []
+    for user_id in user_ids:
+        page.append(user_id)
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _fetch_page(backend, user_ids, fetch_pool):
+    """
+    Returns [(user_id, user_data, history)] for one page: profiles in one batch read,
+    histories with concurrent queries. Histories bypass the shared history cache.
+    """
+    with timed("cohort_page_fetch"):
+        users = backend.get_users(user_ids)
+        records = fetch_pool.map(fetch_test_records, user_ids)
+        return [(user_id, users.get(user_id), build_user_history(user_id, user_records))
+                for user_id, user_records in zip(user_ids, records)]
+
+
+def _prefetch(pages, backend, out_queue, stop, fetch_threads):
+    # Producer thread: the bounded queue blocks it when the workers fall behind
+    try:
+        with ThreadPoolExecutor(max_workers=fetch_threads) as fetch_pool:
+            for page in pages:
+                if stop.is_set():
+                    break
+                out_queue.put(_fetch_page(backend, page, fetch_pool))
+    except Exception as e:
+        out_queue.put(e)
+    out_queue.put(None)
+
+
+def _init_report_worker(catalogue):
+    # Worker processes get the parent's reference snapshot and never reload it
+    reference_store.ttl = None
+    reference_store.install(catalogue)
+
+
+def _render_report(user_id, user_data, history):
+    report = generate_medical_report_from_firestore(user_id, history=history, user_data=user_data, use_cache=False)
+    return report.getvalue()
+
+
+class _DirectoryWriter:
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest_path = os.path.join(path, MANIFEST_NAME)
+
+    def write(self, name, data):
+        path = os.path.join(self.path, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def has(self, name):
+        return os.path.exists(os.path.join(self.path, name))
+
+    def reset(self):
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+
+    def close(self):
+        pass
+
+
+class _ZipWriter:
+    # Reports are written as files to a staging directory next to the archive and the
+    # archive is built from them (and from an earlier archive) once, when the run ends.
+    # A crash leaves the staged files and the manifest for the next run to resume from.
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = f"{path}.{MANIFEST_NAME}"
+        self.staging = _DirectoryWriter(f"{path}.parts")
+        self._archived = self._read_archive()
+
+    def _read_archive(self):
+        """
+        Returns the entry names of an existing archive; an unreadable one is discarded.
+        """
+        if not os.path.exists(self.path):
+            return set()
+        try:
+            with zipfile.ZipFile(self.path) as archive:
+                if archive.testzip() is None:
+                    return set(archive.namelist())
+        except (zipfile.BadZipFile, OSError):
+            pass
+        warn(f"{self.path} is not a valid archive; its reports will be generated again.")
+        os.remove(self.path)
+        return set()
+
+    def write(self, name, data):
+        self.staging.write(name, data)
+
+    def has(self, name):
+        return name in self._archived or self.staging.has(name)
+
+    def reset(self):
+        for path in (self.path, self.manifest_path):
+            if os.path.exists(path):
+                os.remove(path)
+        shutil.rmtree(self.staging.path, ignore_errors=True)
+        os.makedirs(self.staging.path)
+        self._archived = set()
+
+    def close(self):
+        staged = sorted(name for name in os.listdir(self.staging.path) if name.endswith(".pdf"))
+        if not staged:
+            shutil.rmtree(self.staging.path, ignore_errors=True)
+            return
+        tmp_path = f"{self.path}.tmp"
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_STORED) as archive:
+            if self._archived:
+                with zipfile.ZipFile(self.path) as previous:
+                    for info in previous.infolist():
+                        if info.filename not in staged:
+                            archive.writestr(info, previous.read(info))
+            for name in staged:
+                archive.write(os.path.join(self.staging.path, name), name)
+        os.replace(tmp_path, self.path)
+        self._archived.update(staged)
+        shutil.rmtree(self.staging.path, ignore_errors=True)
+
+
+def _read_manifest(path, has_report):
+    """
+    Returns the IDs of the users whose report was written by an earlier run.
+
+    Users marked Generated whose report is missing from the output (`has_report(name)` is
+    False) are dropped from the manifest, so they are generated again.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    kept, dropped = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # partially written last line of an interrupted run
+            if entry.get("Status") == "Generated":
+                if not has_report(entry.get("File") or report_filename(entry["User ID"])):
+                    dropped += 1
+                    continue
+                done.add(entry["User ID"])
+            kept.append(line if line.endswith("\n") else line + "\n")
+
+    if dropped:
+        warn(f"{dropped} reports in the manifest are missing from the output; generating them again.")
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(tmp_path, path)
+    return done
+
+
+def generate_cohort_reports(output, user_ids=None, workers=None, page_size=COHORT_PAGE_SIZE,
+                            prefetch_pages=COHORT_PREFETCH_PAGES, fetch_threads=COHORT_FETCH_THREADS,
+                            resume=True, progress_seconds=COHORT_PROGRESS_SECONDS):
+    """
+    Generates PDF reports for many users with bounded memory.
+
+    User IDs are streamed (from the backend when not given) and fetched in pages by a
+    prefetch thread, while reports are rendered on a process pool. At most two reports per
+    worker are in flight and at most `prefetch_pages` pages are buffered, so memory does not
+    grow with the cohort size. Every `page_size` reports the output is checkpointed in a
+    manifest (one JSON line per user); with resume=True users already in the manifest are skipped.
+
+    Parameters:
+    output (str): Output directory, or a path ending in ".zip" to write a single archive. The
+    archive is built when the run ends; until then reports are staged in "<output>.parts".
+    user_ids (iterable): User IDs to report on; defaults to every user of the backend.
+    workers (int): Worker processes; None uses every CPU, 0 or 1 renders in-process.
+    page_size (int): Users per fetched page and per checkpoint.
+    prefetch_pages (int): Fetched pages buffered ahead of the workers.
+    fetch_threads (int): Concurrent history queries while fetching a page.
+    resume (bool): Skip users already generated by an earlier run into the same output.
+    progress_seconds (float): Interval of the progress line, None to disable it.
+
+    Returns:
+    dict: Counts of generated, skipped and failed reports, elapsed seconds and reports per second.
+    """
+    backend = get_backend()
+    writer = _ZipWriter(output) if output.lower().endswith(".zip") else _DirectoryWriter(output)
+    if not resume:
+        writer.reset()
+    done = _read_manifest(writer.manifest_path, writer.has) if resume else set()
+    if user_ids is None:
+        user_ids = backend.stream_user_ids(page_size)
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    pool = None
+    if workers > 1:
+        try:
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_report_worker,
+                                       initargs=({name: reference_store.get(name) for name in reference_store.test_names()},))
+        except (OSError, PicklingError) as e:
+            warn(f"Could not start report workers ({e}); rendering in-process.")
+
+    summary = {"Generated": 0, "Skipped": 0, "Failed": 0}
+    manifest_lines = []
+    started = time.perf_counter()
+    last_progress = started
+
+    def pending(user_ids):
+        # Only requested users found in the manifest count as skipped, not the whole manifest
+        for user_id in user_ids:
+            if user_id in done:
+                summary["Skipped"] += 1
+            else:
+                yield user_id
+
+    def record(user_id, data=None, error=None):
+        if error is None:
+            name = report_filename(user_id)
+            writer.write(name, data)
+            manifest_lines.append({"User ID": user_id, "Status": "Generated", "File": name})
+            summary["Generated"] += 1
+            count_event("cohort_reports")
+        else:
+            manifest_lines.append({"User ID": user_id, "Status": "Failed", "Error": str(error)})
+            summary["Failed"] += 1
+        if len(manifest_lines) >= page_size:
+            checkpoint()
+
+    def checkpoint():
+        if manifest_lines:
+            with open(writer.manifest_path, "a", encoding="utf-8") as f:
+                for entry in manifest_lines:
+                    f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            manifest_lines.clear()
+
+    def report_progress(force=False):
+        nonlocal last_progress
+        now = time.perf_counter()
+        if progress_seconds is None or (not force and now - last_progress < progress_seconds):
+            return
+        last_progress = now
+        elapsed = now - started
+        rate = summary["Generated"] / elapsed if elapsed > 0 else 0.0
+        print(f"Cohort reports: {summary['Generated']} generated, {summary['Failed']} failed, "
+              f"{summary['Skipped']} skipped - {rate:.2f} reports/s")
+
+    def collect(futures, block):
+        finished, _ = wait(futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in finished:
+            user_id = futures.pop(future)
+            try:
+                record(user_id, data=future.result())
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                record(user_id, error=e)
+
+    pages = queue.Queue(maxsize=max(1, prefetch_pages))
+    stop = threading.Event()
+    pending_pages = _iter_pages(pending(user_ids), page_size)
+    prefetcher = threading.Thread(target=_prefetch, args=(pending_pages, backend, pages, stop, fetch_threads),
+                                  name="medassist-cohort-prefetch", daemon=True)
+    prefetcher.start()
+
+    futures = {}
+    fetch_error = None
+    try:
+        while True:
+            page = pages.get()
+            if page is None:
+                break
+            if isinstance(page, Exception):
+                # Finish the reports already in flight so the checkpoint keeps them
+                fetch_error = page
+                break
+            for user_id, user_data, history in page:
+                if user_data is None:
+                    record(user_id, error="User not found.")
+                elif pool is None:
+                    try:
+                        record(user_id, data=_render_report(user_id, user_data, history))
+                    except Exception as e:
+                        record(user_id, error=e)
+                else:
+                    # Backpressure: wait for a slot before submitting more work
+                    while len(futures) >= 2 * workers:
+                        collect(futures, block=True)
+                    futures[pool.submit(_render_report, user_id, user_data, history)] = user_id
+                    collect(futures, block=False)
+                report_progress()
+        while futures:
+            collect(futures, block=True)
+            report_progress()
+        if fetch_error is not None:
+            raise fetch_error
+    finally:
+        stop.set()
+        # Unblock the prefetch thread if it is waiting on a full queue
+        while prefetcher.is_alive():
+            try:
+                pages.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        checkpoint()
+        writer.close()
+
+    elapsed = time.perf_counter() - started
+    summary["Elapsed (s)"] = round(elapsed, 3)
+    summary["Reports / s"] = round(summary["Generated"] / elapsed, 2) if elapsed > 0 else 0.0
+    report_progress(force=True)
+    return summary
@@ -0,0 +1,214 @@
+# Patient Test History
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from .backend import get_backend
+from .instrumentation import count_event, timed, warn
+from .mirror import get_mirror
+
+
+USER_HISTORY_TTL_SECONDS = 60
+USER_HISTORY_CACHE_SIZE = 1024
+
+
+class UserHistory:
+    """
+    Columnar test history of one user.
+
+    All results are kept in three flat arrays sorted by (test, date): `dates` (datetime64),
+    `values` (float) and `offsets`, where the results of `test_names[i]` are
+    `dates[offsets[i]:offsets[i + 1]]` and `values[offsets[i]:offsets[i + 1]]`.
+    """
+
+    def __init__(self, user_id, test_names, dates, values, offsets):
+        self.user_id = user_id
+        self.test_names = test_names
+        self.dates = dates
+        self.values = values
+        self.offsets = offsets
+        self._index = {name: i for i, name in enumerate(test_names)}
+
+    def __len__(self):
+        return len(self.test_names)
+
+    def __contains__(self, test_name):
+        return test_name in self._index
+
+    def __getitem__(self, test_name):
+        i = self._index[test_name]
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.dates[start:end], self.values[start:end]
+
+    def items(self):
+        """
+        Yields (test_name, (dates, values)) for every test, with both arrays sorted by date.
+        """
+        for i, test_name in enumerate(self.test_names):
+            start, end = self.offsets[i], self.offsets[i + 1]
+            yield test_name, (self.dates[start:end], self.values[start:end])
+
+    def latest_values(self):
+        """
+        Returns a dictionary with the most recent value of every test.
+        """
+        return {name: float(self.values[end - 1]) for name, end in zip(self.test_names, self.offsets[1:])}
+
+
+def _parse_dates(raw_dates):
+    """
+    Parses a list of datetimes / date strings in one vectorized pass.
+    Timezone-aware values are converted to naive UTC; unparseable dates become NaT and are
+    counted (`date_parse_failures`) and reported.
+    """
+    try:
+        fast = pd.to_datetime(pd.Series(raw_dates, dtype=object), format="%Y-%m-%d", errors="coerce")
+    except (ValueError, TypeError):
+        fast = None
+    if fast is not None and fast.dtype.kind == "M":
+        parsed = fast.to_numpy(dtype="datetime64[ns]", copy=True)
+    else:
+        # Timezone-aware or mixed values: every date goes through the slow path
+        parsed = np.full(len(raw_dates), np.datetime64("NaT"), dtype="datetime64[ns]")
+
+    missing = np.flatnonzero(np.isnat(parsed))
+    if len(missing):
+        # Slow path for datetimes and other date formats, each converted to naive UTC first
+        parsed[missing] = np.array([_to_naive_utc(raw_dates[i]) for i in missing], dtype="datetime64[ns]")
+        failed = int(np.isnat(parsed[missing]).sum())
+        if failed:
+            count_event("date_parse_failures", failed)
+            warn(f"{failed} test result date(s) could not be parsed; those results are skipped.")
+    return parsed
+
+
+def _to_naive_utc(raw):
+    try:
+        date_obj = pd.Timestamp(raw)
+    except (ValueError, TypeError, OverflowError):
+        return np.datetime64("NaT")
+    if date_obj is pd.NaT:
+        return np.datetime64("NaT")
+    if date_obj.tzinfo is not None:
+        date_obj = date_obj.tz_convert("UTC").tz_localize(None)
+    return date_obj.to_datetime64()
+
+
+def build_user_history(user_id, records):
+    """
+    Builds a UserHistory from an iterable of test result dicts (test_name, value, date).
+    Records with a missing name, a non-numeric value or an invalid date are skipped.
+    """
+    names = []
+    raw_dates = []
+    values = []
+    for data in records:
+        test_name = data.get("test_name")
+        value = data.get("value")
+        date = data.get("date")
+        if test_name and value not in [None, ""] and date:
+            try:
+                values.append(float(value))
+            except (ValueError, TypeError):
+                continue
+            names.append(test_name)
+            raw_dates.append(date)
+
+    with timed("date_parse"):
+        dates = _parse_dates(raw_dates) if raw_dates else np.array([], dtype="datetime64[ns]")
+    values = np.asarray(values, dtype=float)
+    keep = ~np.isnat(dates)
+
+    codes, test_names = pd.factorize(pd.Index(names, dtype=object)[keep])
+    dates = dates[keep]
+    values = values[keep]
+
+    # Stable sort by (test, date) so equal dates keep their stream order
+    order = np.lexsort((dates, codes))
+    codes = codes[order]
+    offsets = np.searchsorted(codes, np.arange(len(test_names) + 1))
+
+    return UserHistory(user_id, list(test_names), dates[order], values[order], offsets)
+
+
+_history_cache = OrderedDict()
+_history_cache_lock = threading.Lock()
+
+
+def load_user_history(user_id, ttl=USER_HISTORY_TTL_SECONDS):
+    """
+    Fetches the user's `test_results` once and returns it as a UserHistory.
+
+    The result is cached for `ttl` seconds, so the trend, prediction and report of one
+    request (or dashboard) share a single backend query. Pass ttl=0 to force a reload.
+    With a local mirror (`set_mirror`) only results newer than the user's watermark are read.
+
+    Parameters:
+    user_id (str): ID of the user.
+    ttl (float): Maximum age in seconds of a cached history.
+
+    Returns:
+    UserHistory: The user's results grouped by test and sorted by date.
+    """
+    history = get_cached_user_history(user_id, ttl)
+    if history is not None:
+        return history
+
+    with timed("history_fetch"):
+        records = fetch_test_records(user_id)
+    with timed("history_parse"):
+        history = build_user_history(user_id, records)
+
+    cache_user_history(history)
+    return history
+
+
+def fetch_test_records(user_id):
+    """
+    Returns the user's test result dicts: from the local mirror (after a delta sync) when
+    one is set with `set_mirror`, otherwise straight from the backend.
+    """
+    mirror = get_mirror()
+    if mirror is not None:
+        return mirror.load_records(user_id)
+    records = list(get_backend().stream_test_results(user_id))
+    count_event("history_reads", len(records))
+    return records
+
+
+def get_cached_user_history(user_id, ttl=USER_HISTORY_TTL_SECONDS):
+    """
+    Returns the cached history of a user if it is younger than `ttl` seconds, else None.
+    """
+    with _history_cache_lock:
+        cached = _history_cache.get(user_id)
+    if cached is not None and ttl and time.monotonic() - cached[0] < ttl:
+        count_event("history_cache_hits")
+        return cached[1]
+    return None
+
+
+def cache_user_history(history):
+    """
+    Stores a freshly loaded history in the cache (evicting the least recently loaded users).
+    """
+    with _history_cache_lock:
+        _history_cache[history.user_id] = (time.monotonic(), history)
+        _history_cache.move_to_end(history.user_id)
+        while len(_history_cache) > USER_HISTORY_CACHE_SIZE:
+            _history_cache.popitem(last=False)
+
+
+def invalidate_user_history(user_id=None):
+    """
+    Drops the cached history of one user, or of every user if user_id is None.
+    """
+    with _history_cache_lock:
+        if user_id is None:
+            _history_cache.clear()
+        else:
+            _history_cache.pop(user_id, None)
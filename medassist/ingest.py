@@ -0,0 +1,573 @@
+# Bulk Lab Result Ingestion
+
+import csv
+import math
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date as date_type, datetime
+from functools import lru_cache
+
+from .backend import FIRESTORE_BATCH_LIMIT, get_backend
+from .history import invalidate_user_history
+from .instrumentation import count_event, timed, warn
+from .reference import reference_store
+from .trend_state import rebuild_trend_state
+
+
+INGEST_BATCH_SIZE = FIRESTORE_BATCH_LIMIT
+INGEST_WRITE_WORKERS = 4
+INGEST_PROGRESS_SECONDS = 10
+INGEST_REJECT_PATH = "ingest_rejects.csv"
+
+# Day-first formats come before month-first ones, as lab exports here use day/month/year
+INGEST_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y/%m/%d", "%d/%m/%y")
+
+REJECT_FIELDS = ["Source", "Line", "Reason", "User ID", "Test", "Value", "Date"]
+
+# A value is plausible within [min_range / factor, max_range * factor] of its catalogue range
+INGEST_PLAUSIBLE_FACTOR = 20
+
+# Result units (after _normalize_unit): (kind, factor). Counts are per microlitre; the other
+# factors convert to the catalogue unit of the same kind (g/dL, %, fL, pg)
+RESULT_UNITS = {
+    "/ul": ("count", 1.0), "10^3/ul": ("count", 1e3), "k/ul": ("count", 1e3), "thou/ul": ("count", 1e3),
+    "10^9/l": ("count", 1e3), "/nl": ("count", 1e3), "10^5/ul": ("count", 1e5), "lakh/ul": ("count", 1e5),
+    "lakhs/ul": ("count", 1e5), "10^6/ul": ("count", 1e6), "m/ul": ("count", 1e6), "mill/ul": ("count", 1e6),
+    "million/ul": ("count", 1e6), "10^12/l": ("count", 1e6), "/pl": ("count", 1e6),
+    "g/dl": ("mass", 1.0), "g/100ml": ("mass", 1.0), "g/l": ("mass", 0.1),
+    "%": ("percent", 1.0), "l/l": ("percent", 100.0),
+    "fl": ("volume", 1.0), "um^3": ("volume", 1.0),
+    "pg": ("cell mass", 1.0),
+}
+
+# Flags printed next to a value in lab exports (not part of the unit)
+_VALUE_FLAGS = {"h", "l", "hh", "ll", "(h)", "(l)", "*", "!", "high", "low", "normal", "abnormal", "critical"}
+
+# Common lab report spellings of the catalogue tests; `aliases` in a blood_tests document adds more
+TEST_NAME_ALIASES = {
+    "White Cell Count": ["WBC", "WBC Count", "White Blood Cells", "White Blood Cell Count", "Leukocytes",
+                         "Leucocytes", "TLC", "Total Leucocytic Count", "Total Leukocyte Count"],
+    "Red Cell Count": ["RBC", "RBC Count", "Red Blood Cells", "Red Blood Cell Count", "Erythrocytes"],
+    "Hemoglobin": ["Hb", "HGB", "Haemoglobin"],
+    "Hematocrit (PCV)": ["Hematocrit", "Haematocrit", "HCT", "PCV", "Packed Cell Volume"],
+    "MCV": ["Mean Corpuscular Volume"],
+    "MCH": ["Mean Corpuscular Hemoglobin", "Mean Corpuscular Haemoglobin"],
+    "MCHC": ["Mean Corpuscular Hemoglobin Concentration", "Mean Corpuscular Haemoglobin Concentration"],
+    "RDW": ["RDW-CV", "RDW CV", "Red Cell Distribution Width"],
+    "Platelet Count": ["Platelets", "Platelet", "PLT", "PLT Count"],
+    "MPV": ["Mean Platelet Volume"],
+    "Lymphocytes": ["Lymph", "LYM#", "Lymphocytes Absolute", "Absolute Lymphocytes"],
+    "Lymphocytes %": ["Lymph %", "LYM%", "Lymphocytes Percent"],
+    "Monocytes": ["Mono", "MON#", "Monocytes Absolute", "Absolute Monocytes"],
+    "Monocytes %": ["Mono %", "MON%", "Monocytes Percent"],
+    "Neutrophils": ["Neut", "NEU#", "Neutrophils Absolute", "Absolute Neutrophils"],
+    "Neutrophils %": ["Neut %", "NEU%", "Neutrophils Percent"],
+    "Eosinophils": ["Eos", "EOS#", "Eosinophils Absolute", "Absolute Eosinophils"],
+    "Eosinophils %": ["Eos %", "EOS%", "Eosinophils Percent"],
+    "Basophils": ["Baso", "BAS#", "Basophils Absolute", "Absolute Basophils"],
+    "Basophils %": ["Baso %", "BAS%", "Basophils Percent"],
+}
+
+# Accepted spellings of the columns of a CSV / XLSX export (after normalize_test_key)
+_COLUMN_ALIASES = {
+    "User ID": ("user id", "userid", "patient id", "uid"),
+    "Test": ("test", "test name", "analyte", "parameter"),
+    "Value": ("value", "result", "test value"),
+    "Date": ("date", "test date", "sample date", "collection date", "report date"),
+}
+
+_NUMBER = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+_THOUSANDS = re.compile(r"-?\d{1,3}(?:,\d{3})+(?:\.\d+)?")
+_REPORT_DATE = re.compile(r"(?:date|collected|reported|received)[^:\n]{0,20}[:\-]?\s*(\d{1,4}[./-]\d{1,2}[./-]\d{1,4})", re.I)
+_RESULT_LINE = re.compile(r"^\s*(?P<name>[A-Za-z][A-Za-z0-9 ()%#/.\-]*?)\s*[:\-]?\s+(?P<value>-?\d[\d,]*(?:\.\d+)?)(?=\s|$|[^\d.,/-])")
+# Unit or flag tokens after a value in a report line; stops at the reference range ("12.0-15.0")
+_UNIT_TOKEN = re.compile(r"^(?:[x×*]?\s*10(?:\^|e|\*\*)?[0-9³⁵⁶⁹¹²]*(?:/\S*)?|\([A-Za-z]+\)|[^\d\s(\[\-][^\s]*)$")
+_SUPERSCRIPTS = str.maketrans({"³": "^3", "⁵": "^5", "⁶": "^6", "⁹": "^9", "¹": "^1", "²": "2", "×": "x", "µ": "u", "μ": "u"})
+
+
+@lru_cache(maxsize=4096)
+def normalize_test_key(name):
+    """
+    Returns the lookup key of a test name or column header: lower case, with "%" and "#" kept
+    as separate tokens and any other punctuation or underscores turned into single spaces.
+    """
+    key = str(name).lower().replace("%", " % ").replace("#", " # ")
+    return " ".join(re.sub(r"[^a-z0-9%#]+", " ", key).split())
+
+
+def build_alias_index(catalogue):
+    """
+    Builds {normalized alias: catalogue test name} from the catalogue names, TEST_NAME_ALIASES and
+    each document's optional `aliases` field (a list or a comma-separated string).
+    """
+    index = {}
+    for test_name, test_info in catalogue.items():
+        aliases = (test_info or {}).get("aliases") or []
+        if isinstance(aliases, str):
+            aliases = aliases.split(",")
+        for alias in [*TEST_NAME_ALIASES.get(test_name, ()), *aliases]:
+            index.setdefault(normalize_test_key(alias), test_name)
+    # Exact catalogue names win over aliases
+    for test_name in catalogue:
+        index[normalize_test_key(test_name)] = test_name
+    index.pop("", None)
+    return index
+
+
+_alias_index = (None, {})
+_alias_index_lock = threading.Lock()
+
+
+def get_alias_index():
+    """
+    Returns the alias index of the current reference catalogue, rebuilt only when its version changes.
+    """
+    global _alias_index
+    version = reference_store.version()
+    with _alias_index_lock:
+        if _alias_index[0] != version:
+            catalogue = {name: reference_store.get(name) for name in reference_store.test_names()}
+            _alias_index = (version, build_alias_index(catalogue))
+        return _alias_index[1]
+
+
+def parse_measurement(raw):
+    """
+    Parses a result value and its unit: numbers, thousands separators ("250,000"), a decimal
+    comma ("13,5"), flags ("15.2 H") and units ("4.5 g/dL", "250 x10^3/uL").
+
+    Returns:
+    tuple: (value, normalized unit or None). Raises ValueError for anything else.
+    """
+    if isinstance(raw, (int, float)) and not isinstance(raw, bool):
+        if raw != raw:
+            raise ValueError("Missing value")
+        return float(raw), None
+    text = str(raw or "").strip()
+    if not text:
+        raise ValueError("Missing value")
+    if text[0] in "<>":
+        raise ValueError(f"Value outside the measurable range: {text}")
+    match = _NUMBER.match(text)
+    if match is None:
+        raise ValueError(f"Invalid value: {text}")
+    number = match.group()
+    number = number.replace(",", "") if _THOUSANDS.fullmatch(number) else number.replace(",", ".")
+    try:
+        value = float(number)
+    except ValueError:
+        raise ValueError(f"Invalid value: {text}") from None
+
+    unit_text = "".join(token for token in text[match.end():].split() if token.lower() not in _VALUE_FLAGS)
+    if not unit_text:
+        return value, None
+    unit = _normalize_unit(unit_text)
+    if unit not in RESULT_UNITS:
+        raise ValueError(f"Unknown unit: {unit_text}")
+    return value, unit
+
+
+@lru_cache(maxsize=256)
+def _normalize_unit(unit_text):
+    """
+    Returns the RESULT_UNITS key of a unit spelling ("x10³/µL" -> "10^3/ul", "/cmm" -> "/ul"), or
+    the cleaned-up text if it is not a known unit.
+    """
+    unit = unit_text.translate(_SUPERSCRIPTS).lower().replace(" ", "")
+    unit = re.sub(r"^[x*]", "", unit).replace("10e", "10^").replace("10**", "10^")
+    unit = re.sub(r"cells/|/(?:cu\.?mm|cmm|mm\^?3)$", lambda m: "" if m.group().startswith("cells") else "/ul", unit)
+    return unit
+
+
+def scale_to_catalogue(test_name, value, unit=None):
+    """
+    Checks a parsed value against the catalogue unit and range magnitude of its test and
+    returns it in the catalogue's scale.
+
+    Cell counts are often reported per microlitre, in thousands or in millions ("250,000",
+    "250 x10^3/uL" and "250" are the same platelet count); they are rescaled by a power of 1000
+    to the plausible magnitude closest to the reference range. Other units are converted
+    (g/L -> g/dL, L/L -> %). A value that stays implausible, or whose unit is of another kind
+    than the catalogue unit, raises ValueError.
+
+    Returns:
+    tuple: (value in the catalogue scale, True if it was rescaled or converted).
+    """
+    test_range = reference_store.get_range(test_name)
+    if test_range is None:
+        return value, False
+    min_range, max_range = test_range
+    catalogue_unit = (reference_store.get(test_name) or {}).get("unit")
+    kind, catalogue_factor = RESULT_UNITS.get(_normalize_unit(str(catalogue_unit or "")), (None, 1.0))
+
+    unit_kind, factor = RESULT_UNITS[unit] if unit is not None else (kind, None)
+    if unit is not None and kind is not None and unit_kind != kind:
+        raise ValueError(f"Unit {unit} does not match the catalogue unit {catalogue_unit} of {test_name}")
+
+    def plausible(candidate):
+        return min_range / INGEST_PLAUSIBLE_FACTOR <= candidate <= max_range * INGEST_PLAUSIBLE_FACTOR
+
+    if unit_kind == "count":
+        if factor is None:
+            # No unit: keep a plausible value as it is, otherwise try the neighbouring scale
+            # (per microlitre <-> thousands, and per microlitre -> millions for a per-million catalogue)
+            if plausible(value):
+                return value, False
+            powers = (-2, -1, 1) if catalogue_factor >= 1e6 else (-1, 1)
+            candidates = [value * 1000.0 ** power for power in powers]
+        else:
+            candidates = [value * factor / 1000.0 ** power for power in range(4)]
+        candidates = [candidate for candidate in candidates if plausible(candidate)]
+        if candidates:
+            centre = (min_range + max_range) / 2 or max_range
+            scaled = min(candidates, key=lambda candidate: abs(math.log(max(candidate, 1e-12) / centre)))
+            return scaled, scaled != value
+    else:
+        scaled = value * factor / catalogue_factor if factor is not None else value
+        if plausible(scaled):
+            return scaled, scaled != value
+
+    raise ValueError(f"Implausible value for {test_name} (reference range {min_range:g}-{max_range:g}"
+                     f"{' ' + catalogue_unit if catalogue_unit else ''}): {value}{' ' + unit if unit else ''}")
+
+
+def parse_date(raw):
+    """
+    Returns a result date as "YYYY-MM-DD" (the format the history parser reads fastest).
+    Raises ValueError for a missing or unrecognized date.
+    """
+    if isinstance(raw, datetime):
+        return raw.strftime("%Y-%m-%d")
+    if isinstance(raw, date_type):
+        return raw.isoformat()
+    return _parse_date_text(str(raw or "").strip())
+
+
+@lru_cache(maxsize=4096)
+def _parse_date_text(text):
+    # Uploads repeat a few distinct dates, and strptime is the slowest step of a row
+    if not text:
+        raise ValueError("Missing date")
+    day = text.split("T")[0].split(" ")[0]
+    for date_format in INGEST_DATE_FORMATS:
+        try:
+            return datetime.strptime(day, date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid date: {text}")
+
+
+def _normalize_row(row, alias_index):
+    """
+    Returns (user ID, test result dict, rescaled flag) for a raw row, or raises ValueError with
+    the reject reason.
+    """
+    user_id = str(row.get("User ID") or "").strip()
+    if not user_id:
+        raise ValueError("Missing user ID")
+    if not row.get("Test"):
+        raise ValueError("Missing test name")
+    test_name = alias_index.get(normalize_test_key(row["Test"]))
+    if test_name is None:
+        raise ValueError(f"Unknown test: {row.get('Test')}")
+    value, rescaled = scale_to_catalogue(test_name, *parse_measurement(row.get("Value")))
+    return user_id, {"test_name": test_name, "value": value, "date": parse_date(row.get("Date"))}, rescaled
+
+
+def _table_rows(source, header, rows, alias_index, user_id=None, date=None, first_line=2):
+    """
+    Yields raw rows from a table export. Long tables have a test and a value column; wide
+    tables (one row per sample) have a column per test, named by any of its aliases.
+    """
+    keys = [normalize_test_key(column or "") for column in header]
+    columns = {}
+    for field, aliases in _COLUMN_ALIASES.items():
+        for i, key in enumerate(keys):
+            if key in aliases and field not in columns:
+                columns[field] = i
+    test_columns = [(i, column) for i, (key, column) in enumerate(zip(keys, header))
+                    if key in alias_index and i not in columns.values()]
+    if "Test" not in columns and not test_columns:
+        raise ValueError(f"No test column and no known test names in the header: {header}")
+
+    def cell(values, field, default):
+        i = columns.get(field)
+        value = values[i] if i is not None and i < len(values) else None
+        return default if value is None or value == "" else value
+
+    for line, values in enumerate(rows, start=first_line):
+        if not any(value not in (None, "") for value in values):
+            continue
+        base = {"Source": source, "Line": line, "User ID": cell(values, "User ID", user_id),
+                "Date": cell(values, "Date", date)}
+        if "Test" in columns:
+            yield {**base, "Test": cell(values, "Test", None), "Value": cell(values, "Value", None)}
+        else:
+            for i, column in test_columns:
+                if i < len(values) and values[i] not in (None, ""):
+                    yield {**base, "Test": column, "Value": values[i]}
+
+
+def read_csv_rows(path, alias_index, user_id=None, date=None):
+    """
+    Streams raw rows from a CSV export (see `_table_rows`). `user_id` and `date` fill in
+    missing user ID / date columns.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return
+        yield from _table_rows(path, header, reader, alias_index, user_id, date)
+
+
+def read_xlsx_rows(path, alias_index, user_id=None, date=None):
+    """
+    Streams raw rows from the first sheet of an XLSX export (read-only mode, so the
+    workbook is never fully loaded).
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield from _table_rows(path, [str(column or "") for column in header], rows, alias_index, user_id, date)
+    finally:
+        workbook.close()
+
+
+def parse_lab_report_text(text, alias_index, source="", user_id=None, date=None):
+    """
+    Yields raw rows from the text layer of a lab report: every line that starts with a known
+    test name (or alias) followed by a number. The report date is taken from a "Date: ..." style
+    line unless `date` is given.
+    """
+    if date is None:
+        match = _REPORT_DATE.search(text)
+        date = match.group(1) if match else None
+    for line, text_line in enumerate(text.splitlines(), start=1):
+        match = _RESULT_LINE.match(text_line)
+        if match is None:
+            continue
+        name = match.group("name")
+        if normalize_test_key(name) not in alias_index:
+            continue
+        # The unit is kept with the value, so every reader goes through the same unit handling
+        units = []
+        for token in text_line[match.end("value"):].split()[:3]:
+            if not _UNIT_TOKEN.match(token):
+                break
+            units.append(token)
+        yield {"Source": source, "Line": line, "User ID": user_id, "Test": name,
+               "Value": " ".join([match.group("value"), *units]), "Date": date}
+
+
+def read_pdf_rows(path, alias_index, user_id=None, date=None):
+    """
+    Streams raw rows from a text-layer lab report PDF (one patient per file, so `user_id`
+    is required; scanned PDFs without a text layer yield nothing).
+    """
+    from PyPDF2 import PdfReader
+
+    text = "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    yield from parse_lab_report_text(text, alias_index, path, user_id, date)
+
+
+def _rebuild_user_trend_state(user_id):
+    try:
+        rebuild_trend_state(user_id)
+    except Exception as e:
+        return user_id, e
+    return user_id, None
+
+
+_READERS = {".csv": read_csv_rows, ".xlsx": read_xlsx_rows, ".xlsm": read_xlsx_rows, ".pdf": read_pdf_rows}
+
+
+def ingest_lab_results(sources, user_id=None, date=None, reject_path=INGEST_REJECT_PATH,
+                       batch_size=INGEST_BATCH_SIZE, workers=INGEST_WRITE_WORKERS, check_users=True,
+                       progress_seconds=INGEST_PROGRESS_SECONDS, rebuild_trends=True):
+    """
+    Streams lab results from PDF / CSV / XLSX files into the users' `test_results`.
+
+    Rows are read one source at a time, test names are mapped to the catalogue with the alias
+    index, and valid rows are written in batches of `batch_size` by a pool of `workers` threads.
+    At most two batches per worker are in flight, so memory does not grow with the upload size.
+    Malformed rows, unknown tests or users, unreadable sources and rows of failed batches go to
+    the reject file (CSV with the reason) instead of stopping the run; a failed user check or
+    write rejects the rows of that batch only, and the source is read on. Once every batch is
+    written, the stored trend state of each user that received results is rebuilt.
+
+    Rows are not deduplicated against the stored results: ingesting the same file twice stores
+    every result twice. Keep track of the uploads already ingested.
+
+    Parameters:
+    sources (list): File paths; the reader is chosen by extension (.pdf, .csv, .xlsx).
+    user_id (str): User of files without a user ID column (required for PDFs).
+    date: Result date of files without a date column or report date.
+    reject_path (str): CSV file receiving the rejected rows (created only if there are any).
+    batch_size (int): Rows per bulk write (at most 500 for Firestore).
+    workers (int): Concurrent write batches.
+    check_users (bool): Reject rows of user IDs that have no user document (one batch read per new user set).
+    progress_seconds (float): Interval of the progress line, None to disable it.
+    rebuild_trends (bool): Rebuild the trend state of the users with written rows (see `rebuild_trend_state`).
+
+    Returns:
+    dict: Counts of rows read, written, rejected and rescaled, trend states rebuilt, elapsed seconds,
+    rows per second and the reject file.
+    """
+    if isinstance(sources, (str, os.PathLike)):
+        sources = [sources]
+    backend = get_backend()
+    alias_index = get_alias_index()
+
+    summary = {"Rows Read": 0, "Rows Written": 0, "Rows Rejected": 0, "Rows Rescaled": 0, "Batches": 0,
+               "Trend States Rebuilt": 0}
+    known_users = {}
+    touched_users = set()
+    batch = []
+    reject_file = None
+    reject_writer = None
+    started = time.perf_counter()
+    last_progress = started
+
+    def reject(row, reason):
+        nonlocal reject_file, reject_writer
+        if reject_writer is None:
+            reject_file = open(reject_path, "w", newline="", encoding="utf-8")
+            reject_writer = csv.DictWriter(reject_file, fieldnames=REJECT_FIELDS, extrasaction="ignore")
+            reject_writer.writeheader()
+        reject_writer.writerow({**row, "Reason": reason})
+        summary["Rows Rejected"] += 1
+        count_event("ingest_rejects")
+
+    def write_batch(rows):
+        with timed("ingest_write"):
+            backend.add_test_results([(user_id, result) for user_id, result, _ in rows])
+        return rows
+
+    def check_batch_users(rows):
+        new_ids = {user_id for user_id, _, _ in rows} - known_users.keys()
+        if new_ids:
+            for found_id, user_data in backend.get_users(sorted(new_ids)).items():
+                known_users[found_id] = user_data is not None
+        valid = []
+        for entry in rows:
+            if known_users.get(entry[0]):
+                valid.append(entry)
+            else:
+                reject(entry[2], "Unknown user")
+        return valid
+
+    def collect(futures, block):
+        finished, _ = wait(futures, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+        for future in finished:
+            rows = futures.pop(future)
+            try:
+                future.result()
+            except Exception as e:
+                for _, _, row in rows:
+                    reject(row, f"Write failed: {e}")
+                continue
+            summary["Rows Written"] += len(rows)
+            summary["Batches"] += 1
+            count_event("ingest_rows", len(rows))
+            for touched_user in {user_id for user_id, _, _ in rows}:
+                invalidate_user_history(touched_user)
+                touched_users.add(touched_user)
+
+    def report_progress(force=False):
+        nonlocal last_progress
+        now = time.perf_counter()
+        if progress_seconds is None or (not force and now - last_progress < progress_seconds):
+            return
+        last_progress = now
+        elapsed = now - started
+        rate = summary["Rows Written"] / elapsed if elapsed > 0 else 0.0
+        print(f"Ingest: {summary['Rows Read']} rows read, {summary['Rows Written']} written, "
+              f"{summary['Rows Rejected']} rejected - {rate:.0f} rows/s")
+
+    futures = {}
+    pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="medassist-ingest")
+
+    def submit(rows):
+        if check_users:
+            try:
+                rows = check_batch_users(rows)
+            except Exception as e:
+                for _, _, row in rows:
+                    reject(row, f"User check failed: {e}")
+                return
+        if not rows:
+            return
+        # Backpressure: wait for a slot before submitting more work
+        while len(futures) >= 2 * max(1, workers):
+            collect(futures, block=True)
+        futures[pool.submit(write_batch, rows)] = rows
+        collect(futures, block=False)
+        report_progress()
+
+    try:
+        for source in sources:
+            source = os.fspath(source)
+            reader = _READERS.get(os.path.splitext(source)[1].lower())
+            if reader is None:
+                reject({"Source": source}, "Unsupported file type")
+                continue
+            rows = reader(source, alias_index, user_id, date)
+            while True:
+                # Only reading is guarded here: lookup and write failures are rejected per row or batch
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    # Rows already read from the source stay queued; the rest of it is rejected as a whole
+                    reject({"Source": source}, f"Could not read source: {e}")
+                    break
+                summary["Rows Read"] += 1
+                try:
+                    user, result, rescaled = _normalize_row(row, alias_index)
+                except ValueError as e:
+                    reject(row, str(e))
+                    continue
+                except Exception as e:
+                    reject(row, f"Lookup failed: {e}")
+                    continue
+                if rescaled:
+                    summary["Rows Rescaled"] += 1
+                    count_event("ingest_rescaled")
+                batch.append((user, result, row))
+                if len(batch) >= batch_size:
+                    submit(batch)
+                    batch = []
+        if batch:
+            submit(batch)
+        while futures:
+            collect(futures, block=True)
+
+        if rebuild_trends and touched_users:
+            # Bulk writes bypass record_test_result, so the incremental trend states are recomputed here
+            with timed("ingest_trend_state"):
+                for user, error in pool.map(_rebuild_user_trend_state, sorted(touched_users)):
+                    if error is None:
+                        summary["Trend States Rebuilt"] += 1
+                    else:
+                        warn(f"Could not rebuild the trend state of user {user}: {error}")
+    finally:
+        pool.shutdown(wait=True)
+        if reject_file is not None:
+            reject_file.close()
+
+    elapsed = time.perf_counter() - started
+    summary["Elapsed (s)"] = round(elapsed, 3)
+    summary["Rows / s"] = round(summary["Rows Written"] / elapsed, 1) if elapsed > 0 else 0.0
+    summary["Reject File"] = reject_path if reject_writer is not None else None
+    report_progress(force=True)
+    return summary
@@ -0,0 +1,222 @@
+# Instrumentation
+
+import functools
+import threading
+import time
+
+
+class MetricsSink:
+    """
+    Receives stage timings and event counts from the analysis code.
+    Subclasses decide where they go (log, Prometheus, in-process collector).
+    """
+
+    def timing(self, stage, seconds):
+        pass
+
+    def count(self, event, amount=1):
+        pass
+
+
+class LoggingSink(MetricsSink):
+    """
+    Logs every timing and count on the `medassist.metrics` logger.
+    """
+
+    def __init__(self, logger=None, level=None):
+        import logging
+
+        self.logger = logger or logging.getLogger("medassist.metrics")
+        level = logging.DEBUG if level is None else level
+        self.level = level
+
+    def timing(self, stage, seconds):
+        self.logger.log(self.level, "stage=%s seconds=%.6f", stage, seconds)
+
+    def count(self, event, amount=1):
+        self.logger.log(self.level, "event=%s count=%d", event, amount)
+
+
+class CollectorSink(MetricsSink):
+    """
+    Keeps every timing and the running counts in memory, for tests and benchmarks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timings = {}
+        self.counts = {}
+
+    def timing(self, stage, seconds):
+        with self._lock:
+            self.timings.setdefault(stage, []).append(seconds)
+
+    def count(self, event, amount=1):
+        with self._lock:
+            self.counts[event] = self.counts.get(event, 0) + amount
+
+    def summary(self):
+        """
+        Returns {stage: {"Calls", "Total (s)", "Mean (ms)"}} for the collected timings.
+        """
+        with self._lock:
+            timings = {stage: list(values) for stage, values in self.timings.items()}
+        return {
+            stage: {
+                "Calls": len(values),
+                "Total (s)": round(sum(values), 6),
+                "Mean (ms)": round(sum(values) / len(values) * 1000, 3),
+            }
+            for stage, values in timings.items()
+        }
+
+    def reset(self):
+        with self._lock:
+            self.timings.clear()
+            self.counts.clear()
+
+
+class PrometheusSink(MetricsSink):
+    """
+    Aggregates timings as summaries and counts as counters, and renders them in the
+    Prometheus text exposition format (serve `render()` from a /metrics endpoint).
+    """
+
+    def __init__(self, namespace="medassist"):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._seconds = {}
+        self._counts = {}
+
+    def timing(self, stage, seconds):
+        with self._lock:
+            total, calls = self._seconds.get(stage, (0.0, 0))
+            self._seconds[stage] = (total + seconds, calls + 1)
+
+    def count(self, event, amount=1):
+        with self._lock:
+            self._counts[event] = self._counts.get(event, 0) + amount
+
+    def render(self):
+        with self._lock:
+            seconds = dict(self._seconds)
+            counts = dict(self._counts)
+
+        name = f"{self.namespace}_stage_seconds"
+        lines = [f"# HELP {name} Time spent in each processing stage.", f"# TYPE {name} summary"]
+        for stage, (total, calls) in sorted(seconds.items()):
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {calls}')
+
+        name = f"{self.namespace}_events_total"
+        lines += [f"# HELP {name} Backend reads, cache hits and other events.", f"# TYPE {name} counter"]
+        for event, total in sorted(counts.items()):
+            lines.append(f'{name}{{event="{event}"}} {total}')
+        return "\n".join(lines) + "\n"
+
+
+_metrics_sink = None
+
+
+def set_metrics_sink(sink):
+    """
+    Enables instrumentation with the given sink, or disables it with None (the default).
+    """
+    global _metrics_sink
+    _metrics_sink = sink
+    return sink
+
+
+def get_metrics_sink():
+    return _metrics_sink
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _StageTimer:
+    __slots__ = ("stage", "sink", "started")
+
+    def __init__(self, stage, sink):
+        self.stage = stage
+        self.sink = sink
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.sink.timing(self.stage, time.perf_counter() - self.started)
+        return False
+
+
+def timed(stage):
+    """
+    Context manager that reports the duration of a stage to the metrics sink.
+    With no sink configured it returns a shared no-op object, so the cost is one global lookup.
+
+        with timed("pdf_build"):
+            pdf.build(story)
+    """
+    sink = _metrics_sink
+    if sink is None:
+        return _NULL_TIMER
+    return _StageTimer(stage, sink)
+
+
+def timed_stage(stage):
+    """
+    Decorator form of `timed`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            sink = _metrics_sink
+            if sink is None:
+                return func(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                sink.timing(stage, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def count_event(event, amount=1):
+    """
+    Adds `amount` to an event counter (backend reads, plots rendered or cached, ...).
+    """
+    sink = _metrics_sink
+    if sink is not None:
+        sink.count(event, amount)
+
+
+_warned = set()
+_warned_lock = threading.Lock()
+
+
+def warn(message, once=False):
+    """
+    Logs a warning on the `medassist` logger and counts it as a `warnings` event.
+    With `once`, a message already logged by this process is only counted, so warnings
+    that would repeat on every request of a long-running service appear a single time.
+    """
+    count_event("warnings")
+    if once:
+        with _warned_lock:
+            if message in _warned:
+                return
+            _warned.add(message)
+
+    import logging
+
+    logging.getLogger("medassist").warning(message)
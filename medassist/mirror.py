@@ -0,0 +1,182 @@
+# Local History Mirror
+
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from .backend import get_backend
+from .instrumentation import count_event, timed
+
+
+# Watermark of a user whose synced results carry no `created_at` (only newer results are pulled next time)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS test_results (
+    user_id TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    test_name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (user_id, doc_id)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    user_id TEXT PRIMARY KEY,
+    watermark TEXT NOT NULL
+);
+"""
+
+
+def _to_utc(created_at):
+    if created_at.tzinfo is None:
+        return created_at.replace(tzinfo=timezone.utc)
+    return created_at.astimezone(timezone.utc)
+
+
+def _mirror_row(user_id, doc_id, data):
+    """
+    Returns the row stored for one result, or None if build_user_history would skip it anyway.
+    """
+    test_name = data.get("test_name")
+    date = data.get("date")
+    if not test_name or not date:
+        return None
+    try:
+        value = float(data.get("value"))
+    except (ValueError, TypeError):
+        return None
+    date = date.isoformat() if hasattr(date, "isoformat") else str(date)
+    return user_id, doc_id, test_name, date, value
+
+
+class LocalMirror:
+    """
+    SQLite copy of the users' `test_results`, kept current by delta sync.
+
+    Every user has a watermark: the newest `created_at` among their mirrored results. A sync
+    asks the backend only for results created after it, so a returning patient costs one
+    (usually empty) query instead of re-reading the whole history. The first sync of a user
+    pulls everything. Results edited or deleted in place are not detected; call
+    `resync(user_id)` after such changes.
+
+    The database file can be shared by several processes (it uses WAL mode); every thread
+    gets its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(_SCHEMA)
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def watermark(self, user_id):
+        """
+        Returns the user's last synced `created_at` (UTC), or None if the user was never synced.
+        """
+        row = self._conn().execute("SELECT watermark FROM sync_state WHERE user_id = ?", (user_id,)).fetchone()
+        return datetime.fromisoformat(row[0]) if row else None
+
+    def sync(self, user_id):
+        """
+        Pulls the user's results created after the watermark and stores them.
+
+        Returns:
+        int: Number of results pulled from the backend.
+        """
+        since = self.watermark(user_id)
+        rows = []
+        newest = since
+        with timed("mirror_sync"):
+            for doc_id, data in get_backend().stream_test_result_changes(user_id, since):
+                created_at = data.get("created_at")
+                if isinstance(created_at, datetime):
+                    created_at = _to_utc(created_at)
+                    if newest is None or created_at > newest:
+                        newest = created_at
+                row = _mirror_row(user_id, doc_id, data)
+                if row is not None:
+                    rows.append(row)
+        count_event("history_reads", len(rows))
+
+        if newest is None:
+            newest = _EPOCH
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO test_results VALUES (?, ?, ?, ?, ?)", rows)
+                conn.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (user_id, newest.isoformat()))
+        return len(rows)
+
+    def resync(self, user_id):
+        """
+        Drops the user's mirrored results and pulls the full history again.
+        """
+        self.forget(user_id)
+        return self.sync(user_id)
+
+    def forget(self, user_id):
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM test_results WHERE user_id = ?", (user_id,))
+                conn.execute("DELETE FROM sync_state WHERE user_id = ?", (user_id,))
+
+    def clear(self):
+        """
+        Empties the mirror (e.g. after switching to another backend).
+        """
+        with self._write_lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM test_results")
+                conn.execute("DELETE FROM sync_state")
+
+    def load_records(self, user_id):
+        """
+        Syncs the user and returns their mirrored results as test result dicts (test_name, value, date).
+        """
+        self.sync(user_id)
+        with timed("mirror_read"):
+            rows = self._conn().execute(
+                "SELECT test_name, value, date FROM test_results WHERE user_id = ? ORDER BY rowid", (user_id,)).fetchall()
+        return [{"test_name": test_name, "value": value, "date": date} for test_name, value, date in rows]
+
+    def stats(self):
+        conn = self._conn()
+        users = conn.execute("SELECT COUNT(*) FROM sync_state").fetchone()[0]
+        results = conn.execute("SELECT COUNT(*) FROM test_results").fetchone()[0]
+        return {"Users": users, "Results": results}
+
+
+_mirror = None
+
+
+def get_mirror():
+    """
+    Returns the active local mirror, or None if histories are read from the backend directly.
+    """
+    return _mirror
+
+
+def set_mirror(mirror):
+    """
+    Makes history loads (trend, prediction, reports) read through a LocalMirror, or
+    turns the mirror off with None. Returns the mirror.
+    """
+    from .history import invalidate_user_history
+
+    global _mirror
+    _mirror = mirror
+    invalidate_user_history()
+    return mirror
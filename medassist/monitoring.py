@@ -0,0 +1,319 @@
+# Monitoring
+
+import numpy as np
+import pandas as pd
+
+from .backend import get_backend
+from .history import load_user_history
+from .instrumentation import timed
+from .prediction import history_days
+from .reference import patient_demographics, reference_store
+
+
+def analyze_trend_from_firestore(user_id, history=None, user_data=None):
+    """
+    Analyzes trends for all medical tests over each test's full history (see `trend_features_batch`):
+    the slope of the latest results against their noise, an EWMA of the values and a
+    change-point statistic, mapped to a trend status and monitoring priority.
+
+    Parameters:
+    - user_id: str - ID of the user.
+    - history: UserHistory - Optional pre-loaded history (see `load_user_history`), so one fetch
+      can be shared with the prediction and the report.
+    - user_data: dict - Optional pre-loaded user profile. Its age and sex select demographic
+      reference ranges; it is only fetched when the catalogue has such ranges.
+
+    Returns:
+    - List of dicts with trend status, past values (if any), monitoring priority and the
+      trend metrics (if applicable).
+    """
+    results = []
+
+    if history is None:
+        history = load_user_history(user_id)
+    if user_data is None and reference_store.has_demographic_ranges():
+        user_data = get_backend().get_user(user_id)
+    age, sex = patient_demographics(user_data)
+
+    ranges = [reference_store.get_range(test_name, age, sex) for test_name in history.test_names]
+    min_range = np.array([r[0] if r else np.nan for r in ranges], dtype=float)
+    max_range = np.array([r[1] if r else np.nan for r in ranges], dtype=float)
+
+    with timed("trend_analysis"):
+        features = trend_features_batch(history_days(history.dates, history.offsets), history.values, history.offsets)
+        trend_status, priority = label_trends(features, min_range, max_range)
+
+    for i, (test_name, (_, values)) in enumerate(history.items()):
+        current_value = float(values[-1])
+
+        # If there's no past data
+        if len(values) < 2:
+            results.append({
+                "Test Name": test_name,
+                "Current Value": current_value,
+                "Trend Status": "No Historical Data"
+            })
+            continue
+
+        if ranges[i] is None:
+            continue
+
+        results.append({
+            "Test Name": test_name,
+            "Current Value": current_value,
+            "Past Values": values[:-1].tolist(),
+            "Trend Status": trend_status[i],
+            "Monitoring Priority": priority[i],
+            "Slope (per 30 Days)": round(float(features["Slope"][i]) * 30, 2),
+            "EWMA": round(float(features["EWMA"][i]), 2),
+            "Variability": _rounded_or_none(features["Variability"][i]),
+            "Change Point": bool(features["Change Point"][i]),
+        })
+
+    return results
+
+
+def _rounded_or_none(value):
+    return None if np.isnan(value) else round(float(value), 2)
+
+
+def analyze_trend_population(histories):
+    """
+    Labels the trend of every test of many users in a single batch (e.g. a nightly sweep).
+    Uses the flat reference range of each test.
+
+    Parameters:
+    histories (iterable): UserHistory objects (see `load_user_history`).
+
+    Returns:
+    DataFrame: One row per (user, test) with the result count, current value, trend
+    metrics, trend status and monitoring priority. Tests with 2+ results but no reference
+    range are left out, as in `analyze_trend_from_firestore`.
+    """
+    user_ids, test_names, dates, values, counts = [], [], [], [], []
+    for history in histories:
+        user_ids.extend([history.user_id] * len(history.test_names))
+        test_names.extend(history.test_names)
+        dates.append(history.dates)
+        values.append(history.values)
+        counts.append(np.diff(history.offsets))
+
+    columns = ["User ID", "Test Name", "Count", "Current Value", "Slope (per 30 Days)", "EWMA",
+               "Variability", "Change Point Score", "Change Point", "Trend Status", "Monitoring Priority"]
+    if not test_names:
+        return pd.DataFrame(columns=columns)
+
+    dates = np.concatenate(dates)
+    values = np.concatenate(values)
+    offsets = np.concatenate([[0], np.cumsum(np.concatenate(counts))])
+
+    # Reference ranges are looked up once per distinct test, not per series
+    codes, unique_names = pd.factorize(pd.Index(test_names, dtype=object))
+    ranges = [reference_store.get_range(name) for name in unique_names]
+    has_range = np.array([r is not None for r in ranges])[codes]
+    min_range = np.array([r[0] if r else np.nan for r in ranges], dtype=float)[codes]
+    max_range = np.array([r[1] if r else np.nan for r in ranges], dtype=float)[codes]
+
+    with timed("trend_analysis"):
+        features = trend_features_batch(history_days(dates, offsets), values, offsets)
+        trend_status, priority = label_trends(features, min_range, max_range)
+
+    frame = pd.DataFrame({
+        "User ID": user_ids,
+        "Test Name": test_names,
+        "Count": features["Count"],
+        "Current Value": features["Current Value"],
+        "Slope (per 30 Days)": features["Slope"] * 30,
+        "EWMA": features["EWMA"],
+        "Variability": features["Variability"],
+        "Change Point Score": features["Change Point Score"],
+        "Change Point": features["Change Point"],
+        "Trend Status": trend_status,
+        "Monitoring Priority": priority,
+    }, columns=columns)
+    return frame[has_range | (features["Count"] < 2)].reset_index(drop=True)
+
+
+# Windowed Trend Analysis
+
+TREND_WINDOW = 6                    # latest results used for the slope and its noise level
+TREND_EWMA_HALFLIFE = 2             # results
+TREND_MIN_CHANGE = 0.05             # changes below this share of the reference range width are "Stable"
+TREND_SIGNIFICANCE_Z = 2.0          # with 3+ results in the window, the change must exceed this many standard errors
+CHANGE_POINT_THRESHOLD = 3.5        # noise units; the maximum over all splits needs more than a single-test z
+CHANGE_POINT_MIN_GAIN = 4.0         # variance (noise units) the two levels must explain beyond one line
+CHANGE_POINT_MIN_RESULTS = 4
+CRITICAL_EXCURSION = 0.5            # distance outside the range (share of its width) that is critical on its own
+TREND_PROJECTION_DAYS = 90
+
+_DIRECTION_LABELS = ("Stable (No Change)", "Increasing (Possible Worsening)", "Decreasing (Possible Improvement)")
+_RANGE_LABELS = ("(Within Normal Range)", "(Below Normal)", "(Above Normal)")
+_STATUS_LABELS = np.array([f"{direction} {range_label}" for direction in _DIRECTION_LABELS for range_label in _RANGE_LABELS]
+                          + ["No Historical Data"], dtype=object)
+_PRIORITY_LABELS = np.array(["Stable, monitor every 3 months", "Warning, monitor monthly",
+                             "Critical, monitor weekly", None], dtype=object)
+
+
+def trend_features_batch(days, values, offsets, window=TREND_WINDOW, halflife=TREND_EWMA_HALFLIFE):
+    """
+    Computes trend metrics for many series at once.
+
+    The series use the ragged layout of `forecast_series_batch`: series i is
+    `days[offsets[i]:offsets[i + 1]]` (days since its first point, sorted) with the matching
+    `values`, and holds at least one point. Every metric comes from segment sums and
+    cumulative sums over the concatenated arrays, so there is no per-series Python loop.
+
+    - Slope / Window Change: least-squares line over the latest `window` results, and the change
+      it implies between the first and last of them (the last difference when all share a day).
+    - Variability: residual standard deviation of that line (NaN below 3 results in the window);
+      Change SE is the standard error of Window Change derived from it.
+    - EWMA: exponentially weighted mean of all results (weights halve every `halflife` results).
+    - Change Point Score: largest standardized difference between the means before and after a
+      split (at least 2 results each side), from the CUSUM of the deviations from the series mean,
+      in units of the noise from the median successive difference. Change Point is set when the
+      score exceeds the threshold and the two levels explain clearly more than one line through
+      the series, so a steady trend is not reported as a change point.
+
+    Returns:
+    dict: One array entry per series.
+    """
+    days = np.asarray(days, dtype=float)
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)
+    starts, ends = offsets[:-1], offsets[1:]
+    n_series = len(counts)
+
+    series = np.repeat(np.arange(n_series), counts)
+    position = np.arange(len(values)) - np.repeat(starts, counts)
+    from_end = np.repeat(counts, counts) - 1 - position
+    in_window = from_end < window
+    window_counts = np.minimum(counts, window)
+
+    def segment_sum(arr):
+        return np.bincount(series, weights=arr, minlength=n_series)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Line over the window
+        mean_x = segment_sum(days * in_window) / window_counts
+        mean_y = segment_sum(values * in_window) / window_counts
+        dx = (days - np.repeat(mean_x, counts)) * in_window
+        dy = (values - np.repeat(mean_y, counts)) * in_window
+        sxx = segment_sum(dx * dx)
+        slope = np.where(sxx > 0, segment_sum(dx * dy) / sxx, 0.0)
+        residuals = dy - np.repeat(slope, counts) * dx
+        variability = np.where(window_counts > 2,
+                               np.sqrt(segment_sum(residuals * residuals) / (window_counts - 2)), np.nan)
+
+        current = values[ends - 1]
+        previous = np.where(counts > 1, values[np.maximum(ends - 2, starts)], np.nan)
+        span = days[ends - 1] - days[ends - window_counts]
+        change = np.where(sxx > 0, slope * span, current - previous)
+        change_se = np.where(sxx > 0, variability * span / np.sqrt(sxx), np.nan)
+
+        # EWMA, normalized by the weights so short series are not biased towards zero
+        weights = 0.5 ** (from_end / halflife)
+        ewma = segment_sum(weights * values) / segment_sum(weights)
+
+        # Best split into two levels: standardized CUSUM of the deviations from the series mean
+        full_mean_x = segment_sum(days) / counts
+        full_mean_y = segment_sum(values) / counts
+        full_dx = days - np.repeat(full_mean_x, counts)
+        full_dy = values - np.repeat(full_mean_y, counts)
+        cusum = np.cumsum(full_dy)
+        cusum -= np.repeat(cusum[starts] - full_dy[starts], counts)  # restart at each series
+        before = position + 1
+        after = np.repeat(counts, counts) - before
+        split_ok = (before >= 2) & (after >= 2)
+        shift = np.where(split_ok, np.abs(cusum) / np.sqrt(before * after / np.maximum(before + after, 1)), 0.0)
+        best_shift = np.maximum.reduceat(shift, starts) if n_series else shift
+
+        # Only a shift that fits better than one straight line is a change point, not a steady trend
+        full_sxx = segment_sum(full_dx * full_dx)
+        line_gain = np.where(full_sxx > 0, segment_sum(full_dx * full_dy) ** 2 / full_sxx, 0.0)
+        noise = _step_noise(values, series, position, counts)
+        score = np.where((counts >= CHANGE_POINT_MIN_RESULTS) & (noise > 0), best_shift / noise, np.nan)
+        change_point = ((np.nan_to_num(score) > CHANGE_POINT_THRESHOLD)
+                        & (best_shift ** 2 - line_gain > CHANGE_POINT_MIN_GAIN * noise ** 2))
+
+    return {
+        "Count": counts,
+        "Window Count": window_counts,
+        "Current Value": current,
+        "Previous Value": previous,
+        "Slope": slope,
+        "Window Change": change,
+        "Change SE": change_se,
+        "Variability": variability,
+        "EWMA": ewma,
+        "Change Point Score": score,
+        "Change Point": change_point,
+    }
+
+
+def _step_noise(values, series, position, counts):
+    """
+    Robust noise level per series: the median absolute successive difference, scaled to a
+    standard deviation. A level shift is a single large step, so it barely moves the median.
+    """
+    same_series = position[1:] > 0
+    steps = np.abs(np.diff(values))[same_series]
+    step_series = series[1:][same_series]
+    step_counts = np.maximum(counts - 1, 0)
+    step_starts = np.concatenate([[0], np.cumsum(step_counts)[:-1]])
+
+    steps = steps[np.lexsort((steps, step_series))]
+    noise = np.full(len(counts), np.nan)
+    has_steps = step_counts > 0
+    lower = step_starts[has_steps] + (step_counts[has_steps] - 1) // 2
+    upper = step_starts[has_steps] + step_counts[has_steps] // 2
+    noise[has_steps] = (steps[lower] + steps[upper]) / 2 / (0.6745 * np.sqrt(2))
+    return noise
+
+
+def label_trends(features, min_range, max_range, projection_days=TREND_PROJECTION_DAYS):
+    """
+    Maps the output of `trend_features_batch` to trend status and monitoring priority labels.
+
+    A trend is Increasing / Decreasing when the window change exceeds both TREND_MIN_CHANGE
+    of the reference range width and (with 3+ results) TREND_SIGNIFICANCE_Z standard errors,
+    so noise around a flat level stays Stable. An out-of-range value is Critical when it is
+    moving further out, a change point was detected, or it lies more than CRITICAL_EXCURSION
+    range widths outside; otherwise Warning. An in-range value is Warning when its trend would
+    leave the range within `projection_days`.
+
+    Parameters:
+    features (dict): Output of `trend_features_batch`.
+    min_range, max_range (ndarray): Reference range of each series.
+
+    Returns:
+    tuple: (trend status, monitoring priority) object arrays; series with a single result get
+    "No Historical Data" and no priority.
+    """
+    min_range = np.asarray(min_range, dtype=float)
+    max_range = np.asarray(max_range, dtype=float)
+    current = features["Current Value"]
+    change = features["Window Change"]
+    width = max_range - min_range
+
+    # A zero-width range gives an infinite excursion (Critical) for any value outside it
+    with np.errstate(divide="ignore", invalid="ignore"):
+        threshold = np.fmax(TREND_MIN_CHANGE * width, TREND_SIGNIFICANCE_Z * features["Change SE"])
+        increasing = change > threshold
+        decreasing = change < -threshold
+        below = current < min_range
+        above = current > max_range
+
+        excursion = np.where(below, min_range - current, np.where(above, current - max_range, 0.0)) / width
+        moving_out = (above & increasing) | (below & decreasing)
+        critical = (below | above) & (moving_out | features["Change Point"] | (excursion > CRITICAL_EXCURSION))
+
+        projected = current + features["Slope"] * projection_days
+        leaving = (increasing & (projected > max_range)) | (decreasing & (projected < min_range))
+        warning = (below | above) | leaving
+
+    single = features["Count"] < 2
+    direction = np.where(increasing, 1, np.where(decreasing, 2, 0))
+    status_code = np.where(single, len(_STATUS_LABELS) - 1, direction * 3 + np.where(below, 1, np.where(above, 2, 0)))
+    priority_code = np.where(single, 3, np.where(critical, 2, np.where(warning, 1, 0)))
+    return _STATUS_LABELS[status_code], _PRIORITY_LABELS[priority_code]
@@ -0,0 +1,343 @@
+# Population Analytics
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from .analysis import classify_test_results_batch
+from .backend import get_backend
+from .history import _parse_dates
+from .instrumentation import count_event, timed
+
+
+POPULATION_CHUNK_SIZE = 20000
+SKETCH_COMPRESSION = 100
+HEALTH_SCORE_BINS = np.linspace(0, 100, 11)
+POPULATION_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch in the style of a merging t-digest.
+
+    Values are kept as at most about `compression` / 2 weighted centroids, sized by the
+    arcsine scale function so the tails stay accurate. Sketches built over different parts
+    of the data can be merged in any order, and memory does not grow with the number of values.
+    """
+
+    def __init__(self, compression=SKETCH_COMPRESSION):
+        self.compression = compression
+        self.means = np.empty(0)
+        self.weights = np.empty(0)
+        self.count = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self._pending_means = []
+        self._pending_weights = []
+        self._pending_count = 0
+
+    def update(self, values):
+        """
+        Adds an array of values.
+        """
+        values = np.asarray(values, dtype=float)
+        if not len(values):
+            return
+        self._add(values, np.ones(len(values)))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+    def merge(self, other):
+        """
+        Adds the centroids of another sketch to this one.
+        """
+        other._compress()
+        if other.count:
+            self._add(other.means, other.weights)
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+        return self
+
+    def _add(self, means, weights):
+        self._pending_means.append(means)
+        self._pending_weights.append(weights)
+        self._pending_count += len(means)
+        self.count += float(weights.sum())
+        if self._pending_count > 20 * self.compression:
+            self._compress()
+
+    def _compress(self):
+        if not self._pending_count:
+            return
+        means = np.concatenate([self.means, *self._pending_means])
+        weights = np.concatenate([self.weights, *self._pending_weights])
+        self._pending_means, self._pending_weights, self._pending_count = [], [], 0
+
+        order = np.argsort(means, kind="stable")
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        cumulative = np.cumsum(weights)
+        # k1 scale function: centroids near the tails cover fewer values
+        q = (cumulative - weights / 2) / total
+        k = np.floor(self.compression / (2 * np.pi) * np.arcsin(2 * q - 1))
+        starts = np.flatnonzero(np.r_[True, k[1:] != k[:-1]])
+
+        merged_weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / merged_weights
+        self.weights = merged_weights
+
+    def quantile(self, q):
+        """
+        Returns the approximate q-quantile (0 <= q <= 1), or NaN for an empty sketch.
+        """
+        self._compress()
+        if not self.count:
+            return float("nan")
+        positions = np.cumsum(self.weights) - self.weights / 2
+        xp = np.r_[0.0, positions, self.count]
+        fp = np.r_[self.min, self.means, self.max]
+        return float(np.interp(q * self.count, xp, fp))
+
+
+class _TestStats:
+    def __init__(self):
+        self.count = 0
+        self.low = 0
+        self.high = 0
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.sketch = QuantileSketch()
+
+    def merge(self, other):
+        self.count += other.count
+        self.low += other.low
+        self.high += other.high
+        self.total += other.total
+        self.total_squares += other.total_squares
+        self.sketch.merge(other.sketch)
+
+
+class PopulationStats:
+    """
+    Partial or merged result of the population aggregation.
+
+    Holds, per test, the result count, Low/High counts, running sums and a QuantileSketch of
+    the values, plus a histogram of the users' health scores (computed from each user's latest
+    value per test with the `calculate_risk_score` rules). Users whose results may continue in
+    another shard are kept aside in `pending_users` until `finalize()` scores them.
+    """
+
+    def __init__(self):
+        self.tests = {}
+        self.health_histogram = np.zeros(len(HEALTH_SCORE_BINS) - 1, dtype=np.int64)
+        self.health_total = 0.0
+        self.users = 0
+        self.pending_users = {}
+
+    def merge(self, other):
+        """
+        Merges the stats of another shard into this one and returns self.
+        """
+        for test_name, stats in other.tests.items():
+            self.tests.setdefault(test_name, _TestStats()).merge(stats)
+        self.health_histogram += other.health_histogram
+        self.health_total += other.health_total
+        self.users += other.users
+        for user_id, rows in other.pending_users.items():
+            if user_id in self.pending_users:
+                self.pending_users[user_id] = pd.concat([self.pending_users[user_id], rows], ignore_index=True)
+            else:
+                self.pending_users[user_id] = rows
+        return self
+
+    def finalize(self):
+        """
+        Scores the users that were held back at shard edges. Call once every shard is merged.
+        """
+        if self.pending_users:
+            self._add_health_scores(pd.concat(list(self.pending_users.values()), ignore_index=True))
+            self.pending_users = {}
+        return self
+
+    def _add_test_stats(self, frame):
+        codes = frame["Result"].to_numpy()
+        frame = frame.assign(Low=codes == "Low", High=codes == "High", Square=frame["Value"] ** 2)
+        grouped = frame.groupby("Test Name", sort=False)
+        sums = grouped[["Low", "High", "Value", "Square"]].sum()
+        sizes = grouped.size()
+        for test_name, values in grouped["Value"]:
+            stats = self.tests.setdefault(test_name, _TestStats())
+            stats.count += int(sizes[test_name])
+            stats.low += int(sums.at[test_name, "Low"])
+            stats.high += int(sums.at[test_name, "High"])
+            stats.total += float(sums.at[test_name, "Value"])
+            stats.total_squares += float(sums.at[test_name, "Square"])
+            stats.sketch.update(values.to_numpy())
+
+    def _add_health_scores(self, frame):
+        # Latest value per (user, test): the last by date, ties in stream order (as in UserHistory)
+        latest = frame.sort_values("Date", kind="stable").drop_duplicates(["User ID", "Test Name"], keep="last")
+        per_user = latest.groupby("User ID", sort=False)["Risk Points"].agg(["sum", "size"])
+        health = np.round(100 - per_user["sum"].to_numpy() / (2 * per_user["size"].to_numpy()) * 100, 2)
+        self.health_histogram += np.histogram(health, bins=HEALTH_SCORE_BINS)[0]
+        self.health_total += float(health.sum())
+        self.users += len(health)
+
+    def to_frame(self, quantiles=POPULATION_QUANTILES):
+        """
+        Returns one row per test: count, abnormal/low/high rates, mean, standard deviation,
+        min, approximate quantiles and max.
+        """
+        rows = []
+        for test_name, stats in self.tests.items():
+            mean = stats.total / stats.count
+            variance = max(stats.total_squares / stats.count - mean ** 2, 0.0)
+            row = {
+                "Test Name": test_name,
+                "Count": stats.count,
+                "Abnormal Rate": (stats.low + stats.high) / stats.count,
+                "Low Rate": stats.low / stats.count,
+                "High Rate": stats.high / stats.count,
+                "Mean": mean,
+                "Std": variance ** 0.5,
+                "Min": stats.sketch.min,
+            }
+            for q in quantiles:
+                row[f"P{round(q * 100):02d}"] = stats.sketch.quantile(q)
+            row["Max"] = stats.sketch.max
+            rows.append(row)
+        return pd.DataFrame(rows)
+
+    def health_score_summary(self):
+        """
+        Returns the health score histogram (10-point bins), the number of users per
+        health status of `calculate_risk_score`, and the mean health score.
+        """
+        edges = HEALTH_SCORE_BINS.astype(int)
+        histogram = {f"{lo}-{hi}": int(n) for lo, hi, n in zip(edges[:-1], edges[1:], self.health_histogram)}
+        return {
+            "Users": self.users,
+            "Mean Health Score": round(self.health_total / self.users, 2) if self.users else None,
+            "Histogram": histogram,
+            "Status Counts": {
+                "Low Risk (Healthy)": int(self.health_histogram[8:].sum()),
+                "Moderate Risk (Needs Attention)": int(self.health_histogram[5:8].sum()),
+                "High Risk (Critical Condition)": int(self.health_histogram[:5].sum()),
+            },
+        }
+
+
+def _process_chunk(stats, user_ids, test_names, raw_dates, values, hold_users=()):
+    with timed("population_chunk"):
+        frame = pd.DataFrame({
+            "User ID": user_ids,
+            "Test Name": test_names,
+            "Date": _parse_dates(raw_dates),
+            "Value": np.asarray(values, dtype=float),
+        })
+        frame = frame[frame["Date"].notna()].reset_index(drop=True)
+        if frame.empty:
+            return
+        classified = classify_test_results_batch(frame["Test Name"].to_numpy(), frame["Value"].to_numpy())
+        frame["Result"] = classified["Result"]
+        frame["Risk Points"] = classified["Risk Points"]
+
+        stats._add_test_stats(frame)
+        held = frame["User ID"].isin(hold_users).to_numpy()
+        for user_id in hold_users:
+            rows = frame.loc[frame["User ID"].to_numpy() == user_id, ["User ID", "Test Name", "Date", "Risk Points"]]
+            if len(rows):
+                previous = stats.pending_users.get(user_id)
+                stats.pending_users[user_id] = rows if previous is None else pd.concat([previous, rows], ignore_index=True)
+        stats._add_health_scores(frame[~held])
+    count_event("population_results", len(frame))
+
+
+def aggregate_test_results(rows, chunk_size=POPULATION_CHUNK_SIZE, hold_edge_users=False):
+    """
+    Aggregates a stream of (user ID, test result dict) in chunks of `chunk_size` results.
+
+    The results of a user must be contiguous in the stream. Memory is bounded by the chunk
+    size and the sketches, not by the number of results or users. With hold_edge_users=True
+    the first and last user are not scored but kept in `pending_users`, because their results
+    may continue in a neighbouring shard.
+
+    Returns:
+    PopulationStats: The partial result (call `finalize()` after merging all shards).
+    """
+    stats = PopulationStats()
+    user_ids, test_names, raw_dates, values = [], [], [], []
+    first_user = None
+
+    def flush(final):
+        hold = set()
+        if hold_edge_users:
+            hold.add(first_user)
+            if final:
+                hold.add(user_ids[-1])
+        _process_chunk(stats, user_ids, test_names, raw_dates, values, hold)
+        user_ids.clear()
+        test_names.clear()
+        raw_dates.clear()
+        values.clear()
+
+    for user_id, data in rows:
+        test_name = data.get("test_name")
+        date = data.get("date")
+        try:
+            value = float(data.get("value"))
+        except (ValueError, TypeError):
+            continue
+        if not test_name or not date:
+            continue
+
+        if first_user is None:
+            first_user = user_id
+        if len(user_ids) >= chunk_size and user_id != user_ids[-1]:
+            # Chunks end on a user boundary so a user's latest values are seen together
+            flush(final=False)
+        user_ids.append(user_id)
+        test_names.append(test_name)
+        raw_dates.append(date)
+        values.append(value)
+
+    if user_ids:
+        flush(final=True)
+    return stats
+
+
+def aggregate_shard(shard=0, shards=1, chunk_size=POPULATION_CHUNK_SIZE):
+    """
+    Aggregates one shard of every user's test results (see `StorageBackend.stream_all_test_results`).
+    Shards can run in separate processes or machines; merge their results with `PopulationStats.merge`.
+    """
+    rows = get_backend().stream_all_test_results(shard, shards)
+    return aggregate_test_results(rows, chunk_size, hold_edge_users=shards > 1)
+
+
+def run_population_analytics(shards=None, workers=None, chunk_size=POPULATION_CHUNK_SIZE):
+    """
+    Computes cohort views over every user's results in a single pass over the backend:
+    abnormal rate and value distribution per test, and the health score histogram.
+
+    Parameters:
+    shards (int): Number of parts the results are split into; defaults to `workers`.
+    workers (int): Shards aggregated concurrently (threads, as the work is mostly I/O and NumPy).
+    chunk_size (int): Results processed per vectorized step.
+
+    Returns:
+    PopulationStats: Merged and finalized statistics; see `to_frame()` and `health_score_summary()`.
+    """
+    if workers is None:
+        workers = min(8, os.cpu_count() or 1)
+    shards = shards or workers
+    if shards == 1:
+        return aggregate_shard(0, 1, chunk_size).finalize()
+
+    merged = PopulationStats()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for partial in pool.map(lambda shard: aggregate_shard(shard, shards, chunk_size), range(shards)):
+            merged.merge(partial)
+    return merged.finalize()
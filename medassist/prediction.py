@@ -0,0 +1,196 @@
+# Future Health Risk Prediction
+
+import numpy as np
+import pandas as pd
+
+from .history import load_user_history
+from .instrumentation import timed
+from .reference import reference_store
+
+
+def predict_all_next_values_from_firestore(user_id, history=None, horizons=(30,)):
+    """
+    Predicts the value of every test 30 days (or `horizons` days) after its latest result
+    using a least-squares trend line (see `forecast_series_batch`).
+
+    Parameters:
+    - user_id: str - ID of the user.
+    - history: UserHistory - Optional pre-loaded history (see `load_user_history`).
+    - horizons: tuple - Days ahead to predict; the first horizon also sets "Prediction Date".
+
+    Returns:
+    - List of dicts with the predicted value, prediction date and 95% prediction interval
+      (None with fewer than 3 data points), or a message per test.
+    """
+    results = []
+
+    if history is None:
+        history = load_user_history(user_id)
+
+    with timed("regression_fit"):
+        forecast = forecast_series_batch(history_days(history.dates, history.offsets), history.values,
+                                         history.offsets, horizons)
+
+    for i, (test_name, (dates, values)) in enumerate(history.items()):
+        if len(values) < 2:
+            results.append({
+                "Test Name": test_name,
+                "Message": "Insufficient historical data for prediction (need at least 2 data points)."
+            })
+            continue
+
+        if reference_store.get(test_name) is None:
+            results.append({
+                "Test Name": test_name,
+                "Message": "Test not found in Firestore reference."
+            })
+            continue
+
+        last_date = pd.Timestamp(dates[-1])
+        result = {"Test Name": test_name}
+        for j, horizon in enumerate(horizons):
+            predict_date = last_date + pd.Timedelta(days=horizon)
+            result[f"Predicted Value (Next {horizon} Days)"] = round(float(forecast["Predicted"][i, j]), 2)
+            result["Prediction Date" if j == 0 else f"Prediction Date (Next {horizon} Days)"] = predict_date.strftime('%Y-%m-%d')
+            lower, upper = forecast["Lower"][i, j], forecast["Upper"][i, j]
+            result[f"Prediction Interval (Next {horizon} Days)"] = (
+                [round(float(lower), 2), round(float(upper), 2)] if not np.isnan(lower) else None
+            )
+        results.append(result)
+
+    return results
+
+
+
+
+# Batched Trend Forecasting
+
+FORECAST_HORIZONS = (30, 60, 90)
+PREDICTION_INTERVAL_Z = 1.96  # two-sided 95% (normal approximation)
+
+
+def history_days(dates, offsets):
+    """
+    Converts concatenated, per-series sorted datetime64 dates into whole days since
+    the first date of each series (the x values used by the regression).
+    """
+    counts = np.diff(offsets)
+    if len(dates) == 0:
+        return np.zeros(0, dtype=float)
+    first = np.repeat(dates[offsets[:-1][counts > 0]], counts[counts > 0])
+    return ((dates - first) // np.timedelta64(1, "D")).astype(float)
+
+
+def _segment_sum(arr, offsets):
+    counts = np.diff(offsets)
+    sums = np.zeros(len(counts), dtype=float)
+    nonempty = counts > 0
+    if nonempty.any():
+        sums[nonempty] = np.add.reduceat(arr, offsets[:-1][nonempty])
+    return sums
+
+
+def forecast_series_batch(days, values, offsets, horizons=FORECAST_HORIZONS):
+    """
+    Fits an ordinary least-squares line to many series at once and forecasts each
+    series `horizons` days after its last point.
+
+    The series are given in a ragged layout: series i is `days[offsets[i]:offsets[i + 1]]`
+    (days since its first point, sorted) with the matching `values`. Slope and intercept
+    come from closed-form segment sums, so no per-series Python loop or model object is needed.
+    A series whose days are all equal gets a flat line at its mean, like LinearRegression.
+
+    Parameters:
+    days (ndarray): Concatenated x values of all series.
+    values (ndarray): Concatenated y values of all series.
+    offsets (ndarray): Series boundaries, length = number of series + 1.
+    horizons (tuple): Days after each series' last point to forecast.
+
+    Returns:
+    dict: "Count", "Slope", "Intercept" (one entry per series) and "Predicted", "Lower",
+    "Upper" (series x horizons). The 95% prediction interval is NaN for series with
+    fewer than 3 points, where the residual variance is undefined.
+    """
+    days = np.asarray(days, dtype=float)
+    values = np.asarray(values, dtype=float)
+    offsets = np.asarray(offsets)
+    counts = np.diff(offsets)
+    horizons = np.asarray(horizons, dtype=float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean_x = _segment_sum(days, offsets) / counts
+        mean_y = _segment_sum(values, offsets) / counts
+
+        # Centered second pass keeps the sums stable for long series
+        dx = days - np.repeat(mean_x, counts)
+        dy = values - np.repeat(mean_y, counts)
+        sxx = _segment_sum(dx * dx, offsets)
+        sxy = _segment_sum(dx * dy, offsets)
+
+        slope = np.where(sxx > 0, sxy / sxx, 0.0)
+        intercept = mean_y - slope * mean_x
+
+        residuals = dy - np.repeat(slope, counts) * dx
+        sse = _segment_sum(residuals * residuals, offsets)
+        sigma = np.where(counts > 2, np.sqrt(sse / (counts - 2)), np.nan)
+
+        last_x = np.zeros(len(counts), dtype=float)
+        last_x[counts > 0] = days[offsets[1:][counts > 0] - 1]
+        x_new = last_x[:, None] + horizons[None, :]
+        predicted = intercept[:, None] + slope[:, None] * x_new
+
+        leverage = np.where(sxx[:, None] > 0, (x_new - mean_x[:, None]) ** 2 / sxx[:, None], 0.0)
+        half_width = PREDICTION_INTERVAL_Z * sigma[:, None] * np.sqrt(1 + 1 / counts[:, None] + leverage)
+
+    return {
+        "Count": counts,
+        "Slope": slope,
+        "Intercept": intercept,
+        "Predicted": predicted,
+        "Lower": predicted - half_width,
+        "Upper": predicted + half_width,
+    }
+
+
+def forecast_population(histories, horizons=FORECAST_HORIZONS):
+    """
+    Forecasts every test of many users in a single batch.
+
+    Parameters:
+    histories (iterable): UserHistory objects (see `load_user_history`).
+    horizons (tuple): Days ahead to forecast.
+
+    Returns:
+    DataFrame: One row per (user, test) with the point count, slope, and per-horizon
+    prediction, interval bounds and prediction date.
+    """
+    user_ids, test_names, dates, values, counts = [], [], [], [], []
+    for history in histories:
+        user_ids.extend([history.user_id] * len(history.test_names))
+        test_names.extend(history.test_names)
+        dates.append(history.dates)
+        values.append(history.values)
+        counts.append(np.diff(history.offsets))
+
+    if not test_names:
+        return pd.DataFrame(columns=["User ID", "Test Name", "Count", "Slope"])
+
+    dates = np.concatenate(dates)
+    values = np.concatenate(values)
+    offsets = np.concatenate([[0], np.cumsum(np.concatenate(counts))])
+    with timed("regression_fit"):
+        forecast = forecast_series_batch(history_days(dates, offsets), values, offsets, horizons)
+
+    last_dates = dates[offsets[1:] - 1]
+    frame = pd.DataFrame({
+        "User ID": user_ids,
+        "Test Name": test_names,
+        "Count": forecast["Count"],
+        "Slope": forecast["Slope"],
+    })
+    for j, horizon in enumerate(horizons):
+        frame[f"Predicted Value (Next {horizon} Days)"] = forecast["Predicted"][:, j]
+        frame[f"Lower (Next {horizon} Days)"] = forecast["Lower"][:, j]
+        frame[f"Upper (Next {horizon} Days)"] = forecast["Upper"][:, j]
+        frame[f"Prediction Date (Next {horizon} Days)"] = last_dates + np.timedelta64(int(horizon), "D")
+    return frame
@@ -0,0 +1,287 @@
+# Reference Data Cache
+
+import hashlib
+import json
+import threading
+from bisect import bisect_right
+import time
+
+from .backend import get_backend
+from .instrumentation import count_event, timed, warn
+
+
+REFERENCE_CACHE_TTL_SECONDS = 15 * 60
+
+
+def _parse_range(test_info):
+    """
+    Returns the (min_range, max_range) of a reference document as floats,
+    or None if either bound is missing or not numeric.
+    """
+    try:
+        return float(test_info.get("min_range", None)), float(test_info.get("max_range", None))
+    except (ValueError, TypeError):
+        return None
+
+
+_SEX_ALIASES = {"male": "male", "m": "male", "man": "male", "female": "female", "f": "female", "woman": "female"}
+
+
+def normalize_sex(sex):
+    """
+    Returns "male", "female" or None (unknown) for a sex/gender value from a user document.
+    """
+    if not isinstance(sex, str):
+        return None
+    return _SEX_ALIASES.get(sex.strip().lower())
+
+
+def patient_demographics(user_data):
+    """
+    Returns (age, sex) from a user profile for demographic range lookups: the age as a
+    float (None if missing or not numeric) and the sex normalized by `normalize_sex`.
+    """
+    if not user_data:
+        return None, None
+    try:
+        age = float(user_data.get("age"))
+    except (ValueError, TypeError):
+        age = None
+    return age, normalize_sex(user_data.get("sex", user_data.get("gender")))
+
+
+def _compile_demographic_ranges(test_name, test_info):
+    """
+    Compiles the `demographic_ranges` rows of a reference document into an interval index:
+    {sex: (band starts, band ends, ranges)} with the bands of each sex sorted by start age.
+    Rows are {"sex": "male" / "female" / "any", "min_age", "max_age" (exclusive), "min_range", "max_range"}.
+    """
+    bands = {}
+    for row in test_info.get("demographic_ranges") or ():
+        try:
+            min_age = float(row.get("min_age") or 0)
+            max_age = float(row["max_age"]) if row.get("max_age") not in (None, "") else float("inf")
+            test_range = (float(row["min_range"]), float(row["max_range"]))
+        except (KeyError, ValueError, TypeError, AttributeError):
+            warn(f"Invalid demographic range {row!r} for '{test_name}' ignored.", once=True)
+            continue
+        sex = normalize_sex(row.get("sex")) or "any"
+        bands.setdefault(sex, []).append((min_age, max_age, test_range))
+
+    index = {}
+    for sex, rows in bands.items():
+        rows.sort(key=lambda band: band[0])
+        index[sex] = ([band[0] for band in rows], [band[1] for band in rows], [band[2] for band in rows])
+    return index
+
+
+def _find_band(bands, age):
+    # Binary search for the last band starting at or before `age`
+    if bands is None:
+        return None
+    starts, ends, ranges = bands
+    i = bisect_right(starts, age) - 1
+    if i >= 0 and age < ends[i]:
+        return ranges[i]
+    return None
+
+
+class ReferenceStore:
+    """
+    Process-wide in-memory copy of the `blood_tests` reference catalogue.
+
+    The whole collection is read in a single query and every lookup after that
+    is served from memory, with the min/max ranges already parsed to floats.
+    The snapshot is reloaded once it is older than `ttl` seconds, or straight
+    away when a Firestore change listener started with `watch()` reports an update.
+    Age/sex-dependent ranges (`demographic_ranges`) are compiled into an interval index at load time.
+    """
+
+    def __init__(self, ttl=REFERENCE_CACHE_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._tests = {}
+        self._ranges = {}
+        self._table = None
+        self._demographic = {}
+        self._version = None
+        self._loaded_at = None
+        self._listener = None
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    def install(self, catalogue):
+        """
+        Replaces the snapshot with an already-fetched catalogue ({test name: reference dict}).
+        """
+        tests = dict(catalogue)
+        ranges = {test_name: _parse_range(data) for test_name, data in tests.items()}
+        demographic = {}
+        for test_name, data in tests.items():
+            index = _compile_demographic_ranges(test_name, data)
+            if index:
+                demographic[test_name] = index
+        version = hashlib.sha256(json.dumps(tests, sort_keys=True, default=str).encode()).hexdigest()
+
+        with self._lock:
+            self._tests = tests
+            self._ranges = ranges
+            self._demographic = demographic
+            self._table = None
+            self._version = version
+            self._loaded_at = time.monotonic()
+
+    def is_stale(self):
+        """
+        True if the catalogue has never been loaded or is older than the TTL.
+        """
+        loaded_at = self._loaded_at
+        return loaded_at is None or (self.ttl is not None and time.monotonic() - loaded_at >= self.ttl)
+
+    def _ensure_loaded(self):
+        if self.is_stale():
+            self._refresh_if_stale()
+
+    def _refresh_if_stale(self):
+        # Threads that found the snapshot stale queue here; only the first one reloads it
+        with self._refresh_lock:
+            if self.is_stale():
+                self._load()
+
+    def refresh(self):
+        """
+        Reloads the full catalogue from the storage backend in one query.
+        Concurrent refreshes are serialized.
+        """
+        with self._refresh_lock:
+            self._load()
+
+    def _load(self):
+        with timed("reference_load"):
+            catalogue = get_backend().get_reference_catalogue()
+        count_event("reference_reads", len(catalogue))
+        self.install(catalogue)
+        self.loads += 1
+
+    def invalidate(self):
+        """
+        Drops the current snapshot so the next lookup reloads the catalogue.
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def watch(self):
+        """
+        Keeps the snapshot current with a change listener (Firestore `on_snapshot`) instead
+        of waiting for the TTL. Every change event carries the full collection, so it is
+        installed directly without another read.
+        """
+        if self._listener is None:
+            self._listener = get_backend().watch_reference_catalogue(self.install)
+        return self._listener
+
+    def unwatch(self):
+        if self._listener is not None:
+            self._listener.unsubscribe()
+            self._listener = None
+
+    def get(self, test_name):
+        """
+        Returns the reference document of a test as a dict, or None if the test is
+        not in the catalogue. The returned dict is shared and must not be modified.
+        """
+        self._ensure_loaded()
+        test_info = self._tests.get(test_name)
+        if test_info is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return test_info
+
+    def get_range(self, test_name, age=None, sex=None):
+        """
+        Returns the (min_range, max_range) floats of a test, or None if the test
+        is unknown or its range is missing or invalid.
+
+        With the patient's `age` (and `sex`, any spelling accepted by `normalize_sex`), the
+        demographic bands of the test are searched first: the band for that sex, then the bands
+        for any sex, then the test's flat range. Lookups are a dict access and a binary search
+        over the precompiled band starts, and return shared tuples.
+        """
+        # Same check as _ensure_loaded, inlined on this hot path
+        loaded_at = self._loaded_at
+        if loaded_at is None or (self.ttl is not None and time.monotonic() - loaded_at >= self.ttl):
+            self._refresh_if_stale()
+        if age is not None:
+            bands = self._demographic.get(test_name)
+            if bands is not None:
+                sex = normalize_sex(sex)
+                test_range = _find_band(bands.get(sex), age) if sex is not None else None
+                if test_range is None:
+                    test_range = _find_band(bands.get("any"), age)
+                if test_range is not None:
+                    self.hits += 1
+                    return test_range
+        if test_name not in self._ranges:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._ranges[test_name]
+
+    def range_table(self):
+        """
+        Returns the catalogue ranges in columnar form for vectorized lookups.
+
+        Returns:
+        tuple: (test_index, min_ranges, max_ranges) where `test_index` is a pandas Index of
+        test names and the two float arrays hold the bounds at the same positions.
+        Tests without a valid range have NaN bounds.
+        """
+        import numpy as np
+        import pandas as pd
+
+        self._ensure_loaded()
+        table = self._table
+        if table is None:
+            ranges = self._ranges
+            bounds = np.array([r if r is not None else (np.nan, np.nan) for r in ranges.values()], dtype=float)
+            bounds = bounds.reshape(-1, 2)
+            table = (pd.Index(list(ranges)), bounds[:, 0].copy(), bounds[:, 1].copy())
+            if self._ranges is ranges:
+                self._table = table
+        return table
+
+    def has_demographic_ranges(self):
+        """
+        True if any test of the catalogue defines age/sex-dependent ranges.
+        """
+        self._ensure_loaded()
+        return bool(self._demographic)
+
+    def version(self):
+        """
+        Returns a content hash of the current catalogue; it changes whenever any
+        reference document (range, guide, text) changes.
+        """
+        self._ensure_loaded()
+        return self._version
+
+    def test_names(self):
+        self._ensure_loaded()
+        return list(self._tests)
+
+    def stats(self):
+        """
+        Returns lookup hit/miss counts and the number of catalogue loads.
+        """
+        return {
+            "Hits": self.hits,
+            "Misses": self.misses,
+            "Loads": self.loads,
+            "Tests": len(self._tests),
+        }
+
+
+reference_store = ReferenceStore()
@@ -0,0 +1,340 @@
+# Report for AI-Powered Medical Test Analysis
+
+import io
+from datetime import datetime
+from xml.sax.saxutils import escape
+
+from reportlab.lib.enums import TA_RIGHT
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+from .analysis import calculate_risk_score, classify_against_reference, extract_unique_care_guides
+from .backend import get_backend
+from .charts import grouped_result_drawing, test_result_drawing
+from .history import load_user_history
+from .instrumentation import timed, timed_stage, warn
+from .reference import patient_demographics, reference_store
+from .report_cache import get_report_cache, report_cache_key
+from .translation import REPORT_FONT_SIZE, REPORT_TEXT_WIDTH, get_report_text, register_report_font
+
+
+# Report Classification
+
+def classify_tests_for_report(test_results, plot=False, age=None, sex=None):
+    """
+    Classifies every test of a report (and optionally renders its matplotlib chart).
+
+    Parameters:
+    test_results (dict): A dictionary with test names as keys and test values as values.
+    plot (bool): Also render the PNG charts. The PDF report draws vector charts itself and does not need them.
+    age, sex: Patient demographics for age/sex-dependent reference ranges (optional).
+
+    Returns:
+    dict: Test name -> (result dict, PNG buffer or None), as returned by `classify_test_result`.
+    """
+    classified = {}
+    for test_name, test_value in test_results.items():
+        test_info = reference_store.get(test_name)
+        if test_info is None:
+            classified[test_name] = ({"Message": "Test not found in Firestore."}, None)
+        else:
+            classified[test_name] = classify_against_reference(test_name, test_value, test_info,
+                                                               reference_store.get_range(test_name, age, sex), plot)
+    return classified
+
+
+
+
+# PDF Report
+
+# Size of the chunks yielded by `iter_report_chunks`
+REPORT_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def iter_report_chunks(report, chunk_size=REPORT_STREAM_CHUNK_SIZE):
+    """
+    Yields an in-memory PDF report in chunks, for streaming HTTP responses.
+
+    Parameters:
+    report (io.BytesIO): Buffer returned by `generate_medical_report_from_firestore`.
+    chunk_size (int): Maximum size of each chunk in bytes.
+
+    Returns:
+    generator: Successive `bytes` chunks of the PDF.
+    """
+    view = report.getbuffer()
+    try:
+        for start in range(0, len(view), chunk_size):
+            yield bytes(view[start:start + chunk_size])
+    finally:
+        view.release()
+
+
+# Report Text Layout
+
+class _ReportWriter:
+    """
+    Turns the report's English text into paragraphs: bold "Label:" fields, headings and lines.
+    """
+
+    def __init__(self, styles):
+        self.styles = styles
+
+    def title(self, text):
+        return Paragraph(text, self.styles['Title'])
+
+    def heading(self, text):
+        return Paragraph(f"<b>{text}</b>", self.styles['Heading2'])
+
+    def field(self, label, *values, translate=True):
+        return Paragraph(f"<b>{label}:</b> {' '.join(str(value) for value in values)}", self.styles['Normal'])
+
+    def text(self, text):
+        return Paragraph(text, self.styles['Normal'])
+
+    def bullet(self, text):
+        return Paragraph(f"- {text}", self.styles['Normal'])
+
+
+class _TranslatedReportWriter(_ReportWriter):
+    """
+    Right-to-left writer for translated reports. Every English string is replaced by its
+    pre-shaped lines from the translation cache (see `translation.ReportText`), so building
+    the report does no translation, shaping or bidi work for cached text.
+    """
+
+    def __init__(self, styles, report_text):
+        font = register_report_font()
+        self.report_text = report_text
+        self.font = font
+        self.styles = {
+            "Title": ParagraphStyle("TitleRTL", parent=styles['Title'], fontName=font),
+            "Heading2": ParagraphStyle("Heading2RTL", parent=styles['Heading2'], fontName=font, alignment=TA_RIGHT),
+            "Normal": ParagraphStyle("NormalRTL", parent=styles['Normal'], fontName=font, alignment=TA_RIGHT),
+        }
+
+    def _paragraph(self, lines, style):
+        return Paragraph("<br/>".join(escape(line) for line in lines), self.styles[style])
+
+    def _value_lines(self, value, translate):
+        if not isinstance(value, str):
+            return [str(value)]
+        return self.report_text.lines(value) if translate else self.report_text.shape(value)
+
+    def title(self, text):
+        return self._paragraph(self.report_text.lines(text), "Title")
+
+    def heading(self, text):
+        return self._paragraph(self.report_text.lines(text), "Heading2")
+
+    def field(self, label, *values, translate=True):
+        label_line = self.report_text.line(label)
+        parts = [self._value_lines(value, translate) for value in values]
+        if all(len(part) == 1 for part in parts):
+            # Visual order: the label is on the right, followed (to its left) by the values
+            line = " ".join(part[0] for part in reversed(parts)) + " :" + label_line
+            if stringWidth(line, self.font, REPORT_FONT_SIZE) <= REPORT_TEXT_WIDTH:
+                return self._paragraph([line], "Normal")
+        return self._paragraph([":" + label_line] + [line for part in parts for line in part], "Normal")
+
+    def text(self, text):
+        return self._paragraph(self.report_text.lines(text), "Normal")
+
+    def bullet(self, text):
+        lines = list(self.report_text.lines(text))
+        lines[0] = f"{lines[0]} -"
+        return self._paragraph(lines, "Normal")
+
+
+@timed_stage("report_total")
+def generate_medical_report_from_firestore(user_id, history=None, user_data=None, use_cache=True, language="en"):
+    """
+    Fetches latest test results and user data from Firestore, classifies results,
+    generates a PDF medical report, and returns it as an in-memory buffer (`io.BytesIO`,
+    positioned at the start). Charts are ReportLab vector drawings (see `charts`), and the
+    differential pairs share one multi-panel drawing; nothing touches the disk.
+    Use `iter_report_chunks` to stream the PDF or `.getvalue()` to save it.
+
+    Reports are looked up in the report cache first (see `report_cache_key`), so a patient
+    whose results, reference ranges and header fields are unchanged gets the stored PDF back
+    without classifying, rendering or building anything. Pass use_cache=False to bypass it.
+
+    Classifications are computed up front by `classify_tests_for_report`; `history` and
+    `user_data` can pass in the UserHistory and user profile already loaded for the same request.
+    Without `history`, a cached report is only served after a fresh history read (ttl=0), so
+    results written by another process are never answered with an outdated PDF.
+
+    language="ar" builds the report in Arabic from the translation cache made offline by
+    `build_translation_cache` (falling back to English if it has not been built for the current
+    reference catalogue); charts keep their English labels.
+    """
+
+    # Get user info
+    if user_data is None:
+        with timed("user_fetch"):
+            user_data = get_backend().get_user(user_id)
+    if user_data is None:
+        from fastapi import HTTPException
+        raise HTTPException(status_code=404, detail="User not found.")
+
+    patient_name = user_data.get("username", "Unknown")
+    patient_age = user_data.get("age", "N/A")
+    age, sex = patient_demographics(user_data)
+
+    # Latest test result per test
+    cache = get_report_cache() if use_cache else None
+    if history is None:
+        history = load_user_history(user_id, ttl=0) if cache is not None else load_user_history(user_id)
+    test_results = history.latest_values()
+    report_date = datetime.now().strftime('%Y-%m-%d')
+
+    report_text = None
+    if language != "en":
+        report_text = get_report_text(language)
+        if report_text is None:
+            warn(f"No '{language}' translation cache for the current reference catalogue "
+                 f"(run build_translation_cache); building the report in English.", once=True)
+
+    if cache is not None:
+        cache_key = report_cache_key(patient_name, patient_age, report_date, test_results, sex,
+                                     report_text.version if report_text is not None else "en")
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return io.BytesIO(cached)
+
+    grouped_tests = [
+        ('Lymphocytes', 'Lymphocytes %'),
+        ('Monocytes', 'Monocytes %'),
+        ('Neutrophils', 'Neutrophils %'),
+        ('Eosinophils', 'Eosinophils %'),
+        ('Basophils', 'Basophils %')
+    ]
+
+    report = io.BytesIO()
+    pdf = SimpleDocTemplate(report, pagesize=letter)
+    styles = getSampleStyleSheet()
+    writer = _ReportWriter(styles) if report_text is None else _TranslatedReportWriter(styles, report_text)
+    story = []
+
+    story.append(writer.title("Comprehensive Medical Test Report"))
+    story.append(Spacer(1, 12))
+
+    story.append(writer.field("Patient Name", patient_name, translate=False))
+    story.append(writer.field("Age", patient_age))
+    story.append(writer.field("Date", report_date, translate=False))
+    story.append(Spacer(1, 12))
+
+    abnormal_count = 0
+    processed_tests = set()
+    with timed("report_classify"):
+        classified = classify_tests_for_report(test_results, age=age, sex=sex)
+
+    # Process grouped tests
+    for group in grouped_tests:
+        if all(test in test_results for test in group):
+            group_results = []
+            has_abnormal = False
+            combined_info = {}
+            last_result = None
+
+            for test in group:
+                result, _ = classified[test]
+                group_results.append((test, result))
+                processed_tests.add(test)
+                last_result = result
+                if result.get("Result") != "Normal":
+                    has_abnormal = True
+                    combined_info = result
+
+            panels = []
+            for test, result in group_results:
+                story.append(writer.field("Test", test))
+                story.append(writer.field("Your Value", test_results[test]))
+                story.append(writer.field("Result", result.get('Result', 'Unknown')))
+                story.append(Spacer(1, 6))
+
+                test_range = reference_store.get_range(test, age, sex)
+                if "Result" in result and test_range is not None:
+                    panels.append((test, test_results[test], *test_range))
+
+            # One multi-panel chart for the whole group
+            if panels:
+                story.append(grouped_result_drawing(panels))
+                story.append(Spacer(1, 12))
+
+            if has_abnormal:
+                story.append(writer.field("Possible Diseases", combined_info.get('Possible Diseases', 'N/A')))
+                story.append(writer.field("Treatment Guide", combined_info.get('Treatment Guide', 'N/A')))
+                story.append(writer.field("Suggested Doctor", combined_info.get('Doctor Specialization', 'N/A')))
+                story.append(writer.field("Time to Reach Normal Range", combined_info.get('Time to Reach Normal Range', 'N/A')))
+                abnormal_count += 1
+
+            # Always show these regardless of result
+            story.append(writer.field("Next Recommended Test Date", last_result.get('Next Recommended Test Date', 'N/A')))
+            story.append(writer.field("Health Information", last_result.get('Health Information', 'N/A')))
+            story.append(Spacer(1, 12))
+
+    # Process remaining individual tests
+    for test_name, test_value in test_results.items():
+        if test_name in processed_tests:
+            continue
+
+        result, _ = classified[test_name]
+        story.append(writer.field("Test", test_name))
+        story.append(writer.field("Your Value", test_value))
+
+        if "Result" not in result:
+            story.append(writer.field("Status", "Unable to analyze. Reason:", result.get('Message', 'Unknown error')))
+            story.append(Spacer(1, 12))
+            continue
+
+        story.append(writer.field("Result", result['Result']))
+
+        if result["Result"] != "Normal":
+            story.append(writer.field("Possible Diseases", result.get('Possible Diseases', 'N/A')))
+            story.append(writer.field("Treatment Guide", result.get('Treatment Guide', 'N/A')))
+            story.append(writer.field("Suggested Doctor", result.get('Doctor Specialization', 'N/A')))
+            story.append(writer.field("Time to Reach Normal Range", result.get('Time to Reach Normal Range', 'N/A')))
+            abnormal_count += 1
+
+        story.append(writer.field("Next Recommended Test Date", result.get('Next Recommended Test Date', 'N/A')))
+        story.append(writer.field("Health Information", result.get('Health Information', 'N/A')))
+        story.append(Spacer(1, 12))
+
+        test_range = reference_store.get_range(test_name, age, sex)
+        if test_range is not None:
+            story.append(test_result_drawing(test_name, test_value, *test_range))
+            story.append(Spacer(1, 12))
+
+    # Add health risk score summary
+    story.append(writer.heading("Health Risk Score Summary"))
+    story.append(Spacer(1, 12))
+
+    risk_summary = calculate_risk_score(test_results, age, sex)
+    story.append(writer.field("Total Abnormal Results", risk_summary['Total Abnormal Results']))
+    story.append(writer.field("Health Status", risk_summary['Health Status']))
+    story.append(writer.field("Your Health Insight", risk_summary['Health Summary Message']))
+    story.append(Spacer(1, 12))
+
+    # Add care guides
+    story.append(writer.heading("Care Guides"))
+    story.append(Spacer(1, 12))
+
+    unique_care_guides = extract_unique_care_guides(test_results)
+    if unique_care_guides:
+        for care_guide in unique_care_guides:
+            story.append(writer.bullet(care_guide))
+            story.append(Spacer(1, 6))
+    else:
+        story.append(writer.text("No specific care guides available."))
+    story.append(Spacer(1, 12))
+
+    with timed("pdf_build"):
+        pdf.build(story)
+
+    if cache is not None:
+        cache.put(cache_key, report.getvalue())
+    report.seek(0)
+    return report
\ No newline at end of file
@@ -0,0 +1,223 @@
+# Report Cache
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from .instrumentation import count_event, warn
+from .reference import reference_store
+
+
+# Bump when the report layout changes, so reports built by older code are not served
+REPORT_FORMAT_VERSION = 2
+
+REPORT_CACHE_MEMORY_BYTES = 256 * 1024 * 1024
+REPORT_CACHE_DISK_BYTES = 2 * 1024 * 1024 * 1024
+
+
+def report_cache_key(patient_name, patient_age, report_date, test_results, patient_sex=None, language="en"):
+    """
+    Returns the content hash identifying a report.
+
+    Parameters:
+    patient_name, patient_age, report_date: Header fields printed on the report.
+    patient_sex: Normalized sex, which can select different reference ranges.
+    language: "en", or the `ReportText.version` of a translated report.
+    test_results (dict): Latest value per test.
+
+    Returns:
+    str: SHA-256 hex digest over the header fields, the latest values and the reference
+    catalogue version, so a change to any result or reference range gives a new key.
+
+    The key is only as current as `test_results`: built from a history cached for
+    USER_HISTORY_TTL_SECONDS, it misses results written by another process within that window.
+    `generate_medical_report_from_firestore` reads the history with ttl=0 for this reason
+    unless the caller passes one in.
+    """
+    content = {
+        "Format": REPORT_FORMAT_VERSION,
+        "Patient Name": str(patient_name),
+        "Age": str(patient_age),
+        "Sex": str(patient_sex),
+        "Language": language,
+        "Date": str(report_date),
+        "Results": sorted((name, repr(value)) for name, value in test_results.items()),
+        "Reference": reference_store.version(),
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+class ReportCache:
+    """
+    Two-tier LRU cache of rendered PDF reports (bytes) keyed by `report_cache_key`.
+
+    The memory tier holds up to `memory_bytes` of reports. When `directory` is set, reports are
+    also written there as `<key>.pdf` (atomically, so processes can share the directory) and the
+    least recently used files are removed once the tier exceeds `disk_bytes`. Entries never need
+    explicit invalidation: changed inputs produce a different key, and stale entries age out.
+    """
+
+    def __init__(self, memory_bytes=REPORT_CACHE_MEMORY_BYTES, directory=None, disk_bytes=REPORT_CACHE_DISK_BYTES):
+        self.memory_bytes = memory_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = None
+        self._disk_size = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the cached PDF bytes for `key`, or None.
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+        if data is not None:
+            count_event("report_cache_hits")
+            return data
+
+        data = self._read_disk(key)
+        if data is not None:
+            self._put_memory(key, data)
+            with self._lock:
+                self.disk_hits += 1
+            count_event("report_cache_hits")
+            return data
+
+        with self._lock:
+            self.misses += 1
+        count_event("report_cache_misses")
+        return None
+
+    def put(self, key, data):
+        """
+        Stores the PDF bytes of a report in both tiers.
+        """
+        self._put_memory(key, data)
+        self._write_disk(key, data)
+
+    def clear(self):
+        """
+        Empties the memory tier and deletes the files of the disk tier.
+        """
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+            disk_keys = list(self._disk or ())
+            self._disk = None
+            self._disk_size = 0
+        for key in disk_keys:
+            self._remove_file(key)
+
+    def stats(self):
+        return {
+            "Memory Hits": self.memory_hits,
+            "Disk Hits": self.disk_hits,
+            "Misses": self.misses,
+            "Memory Entries": len(self._memory),
+            "Memory Bytes": self._memory_size,
+            "Disk Entries": len(self._disk or ()),
+            "Disk Bytes": self._disk_size,
+        }
+
+    def _put_memory(self, key, data):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_size -= len(previous)
+            self._memory[key] = data
+            self._memory_size += len(data)
+            while self._memory_size > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pdf")
+
+    def _load_disk_index(self):
+        # Called with the lock held; rebuilds the LRU order from file modification times
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pdf") and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        entries.sort()
+        self._disk = OrderedDict((key, size) for _, key, size in entries)
+        self._disk_size = sum(self._disk.values())
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+            os.utime(self._path(key))
+        except OSError:
+            return None
+        with self._lock:
+            if self._disk is not None and key in self._disk:
+                self._disk.move_to_end(key)
+        return data
+
+    def _write_disk(self, key, data):
+        if not self.directory or len(data) > self.disk_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            warn(f"Could not write report cache entry {path}: {e}")
+            return
+
+        evicted = []
+        with self._lock:
+            if self._disk is None:
+                self._load_disk_index()
+            else:
+                self._disk_size -= self._disk.pop(key, 0)
+                self._disk[key] = len(data)
+                self._disk_size += len(data)
+            while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+                old_key, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(old_key)
+        for old_key in evicted:
+            self._remove_file(old_key)
+
+    def _remove_file(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+
+report_cache = ReportCache()
+
+
+def get_report_cache():
+    return report_cache
+
+
+def set_report_cache(cache):
+    """
+    Replaces the process-wide report cache (e.g. to enable the disk tier), or disables
+    caching with None. Returns the new cache.
+    """
+    global report_cache
+    report_cache = cache
+    return cache
@@ -0,0 +1,207 @@
+# HTTP Service
+#
+# Run with: uvicorn medassist.service:app --workers 4
+
+import asyncio
+import functools
+import os
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Union
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from .analysis import calculate_risk_score, classify_test_result, extract_unique_care_guides
+from .async_backend import async_backend_for
+from .backend import get_backend
+from .history import build_user_history, cache_user_history, fetch_test_records, get_cached_user_history
+from .instrumentation import count_event, timed
+from .mirror import get_mirror
+from .monitoring import analyze_trend_from_firestore
+from .prediction import predict_all_next_values_from_firestore
+from .reference import normalize_sex, reference_store
+from .report import generate_medical_report_from_firestore, iter_report_chunks
+
+
+# Threads used for CPU-bound work (history parsing, analyses, chart rendering, PDF builds)
+SERVICE_RENDER_WORKERS = min(8, (os.cpu_count() or 1) + 2)
+
+
+class ClassifyRequest(BaseModel):
+    test_name: str
+    test_value: Union[float, str]
+    age: Optional[float] = None
+    sex: Optional[str] = None
+
+
+class RiskScoreRequest(BaseModel):
+    test_results: Dict[str, Union[float, str]]
+    age: Optional[float] = None
+    sex: Optional[str] = None
+
+
+class AnalysisService:
+    """
+    Async facade over the analysis functions.
+
+    Independent reads of a request (user profile, history, reference catalogue) are awaited
+    concurrently on an async backend, and CPU-bound work runs on a thread pool so the
+    event loop can keep serving other requests.
+    """
+
+    def __init__(self, async_backend=None, render_workers=SERVICE_RENDER_WORKERS):
+        self._async_backend = async_backend
+        self.render_workers = render_workers
+        self._executor = None
+        self._reference_lock = None
+
+    @property
+    def async_backend(self):
+        if self._async_backend is None:
+            self._async_backend = async_backend_for(get_backend())
+        return self._async_backend
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.render_workers, thread_name_prefix="medassist-worker")
+        return self._executor
+
+    def close(self):
+        """
+        Shuts down the worker threads; they are recreated on the next request.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._reference_lock = None
+
+    async def run(self, func, *args, **kwargs):
+        """
+        Runs a blocking function on the service's thread pool.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def ensure_reference(self):
+        """
+        Loads the reference catalogue if it is stale; concurrent requests share one load.
+        """
+        if not reference_store.is_stale():
+            return
+        if self._reference_lock is None:
+            self._reference_lock = asyncio.Lock()
+        async with self._reference_lock:
+            if reference_store.is_stale():
+                with timed("reference_load"):
+                    catalogue = await self.async_backend.get_reference_catalogue()
+                count_event("reference_reads", len(catalogue))
+                reference_store.install(catalogue)
+                reference_store.loads += 1
+
+    async def load_user(self, user_id):
+        with timed("user_fetch"):
+            user_data = await self.async_backend.get_user(user_id)
+        if user_data is None:
+            raise HTTPException(status_code=404, detail="User not found.")
+        return user_data
+
+    async def load_history(self, user_id):
+        history = get_cached_user_history(user_id)
+        if history is None:
+            with timed("history_fetch"):
+                if get_mirror() is not None:
+                    # Delta sync against the local mirror (SQLite, so on a worker thread)
+                    records = await self.run(fetch_test_records, user_id)
+                else:
+                    records = await self.async_backend.get_test_results(user_id)
+                    count_event("history_reads", len(records))
+            history = await self.run(build_user_history, user_id, records)
+            cache_user_history(history)
+        return history
+
+    async def load_patient(self, user_id):
+        """
+        Fetches the user profile, the history and (if stale) the reference catalogue concurrently.
+        """
+        user_data, history, _ = await asyncio.gather(
+            self.load_user(user_id), self.load_history(user_id), self.ensure_reference()
+        )
+        return user_data, history
+
+    async def classify(self, test_name, test_value, age=None, sex=None):
+        await self.ensure_reference()
+        result, _ = await self.run(classify_test_result, test_name, test_value, plot=False, age=age,
+                                   sex=normalize_sex(sex))
+        return result
+
+    async def risk_score(self, test_results, age=None, sex=None):
+        await self.ensure_reference()
+        return await self.run(self._risk_summary, test_results, age, normalize_sex(sex))
+
+    @staticmethod
+    def _risk_summary(test_results, age, sex):
+        summary = calculate_risk_score(test_results, age, sex)
+        summary["Care Guides"] = extract_unique_care_guides(test_results)
+        return summary
+
+    async def trend(self, user_id):
+        user_data, history = await self.load_patient(user_id)
+        return await self.run(analyze_trend_from_firestore, user_id, history=history, user_data=user_data)
+
+    async def prediction(self, user_id):
+        _, history = await self.load_patient(user_id)
+        return await self.run(predict_all_next_values_from_firestore, user_id, history=history)
+
+    async def report(self, user_id, language="en"):
+        """
+        Builds the PDF report in memory off the event loop and returns the buffer.
+        """
+        user_data, history = await self.load_patient(user_id)
+        return await self.run(generate_medical_report_from_firestore, user_id, history=history, user_data=user_data,
+                              language=language)
+
+
+def create_app(service=None):
+    """
+    Creates the FastAPI application exposing classify, risk score, trend, prediction and report.
+    """
+    service = service or AnalysisService()
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        service.close()
+
+    app = FastAPI(title="MedAssist Blood Test Analyzer", lifespan=lifespan)
+    app.state.service = service
+
+    @app.post("/classify")
+    async def classify(request: ClassifyRequest):
+        return await service.classify(request.test_name, request.test_value, request.age, request.sex)
+
+    @app.post("/risk-score")
+    async def risk_score(request: RiskScoreRequest):
+        return await service.risk_score(request.test_results, request.age, request.sex)
+
+    @app.get("/users/{user_id}/trend")
+    async def trend(user_id: str):
+        return await service.trend(user_id)
+
+    @app.get("/users/{user_id}/prediction")
+    async def prediction(user_id: str):
+        return await service.prediction(user_id)
+
+    @app.get("/users/{user_id}/report")
+    async def report(user_id: str, language: str = "en"):
+        report = await service.report(user_id, language)
+        headers = {"Content-Disposition": f'attachment; filename="medical_report_{user_id}.pdf"',
+                   "Content-Length": str(report.getbuffer().nbytes)}
+        return StreamingResponse(iter_report_chunks(report), media_type="application/pdf", headers=headers)
+
+    return app
+
+
+app = create_app()
@@ -0,0 +1,403 @@
+# Bilingual Report Text
+
+import glob
+import importlib.util
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+from .analysis import (HEALTH_MESSAGE_CRITICAL, HEALTH_MESSAGE_FOLLOW_UP, HEALTH_MESSAGE_GOOD, TIME_TO_NORMAL_HIGH,
+                       TIME_TO_NORMAL_LOW, format_duration, health_summary)
+from .backend import REFERENCE_XLSX_PATH
+from .instrumentation import count_event, timed, warn
+from .reference import reference_store
+
+
+TRANSLATION_CACHE_DIR = os.path.join(os.path.dirname(REFERENCE_XLSX_PATH), "translations")
+TRANSLATION_FORMAT_VERSION = 1
+REPORT_LANGUAGES = ("en", "ar")
+TRANSLATE_BATCH_SIZE = 25
+TRANSLATE_RETRIES = 3
+
+# Layout the Arabic lines are wrapped for: the report's Normal style on a letter page with 1 inch margins
+REPORT_FONT_NAME = "MedAssistArabic"
+REPORT_FONT_SIZE = 10
+REPORT_TEXT_WIDTH = 460
+ARABIC_FONT_PATH = None  # any TTF with Arabic glyphs; defaults to the DejaVu Sans bundled with matplotlib
+
+# Range of the templated sentences rendered ahead of time (longer times are rendered on demand)
+TEMPLATE_MAX_MONTHS = 12
+TEMPLATE_MAX_TESTS = 40
+
+# Catalogue fields printed in reports
+CATALOGUE_TEXT_FIELDS = ("health_information", "care_guide", "treatment_guide", "low_values_indicate",
+                         "high_values_indicate", "low_doctor_specialization_to_visit",
+                         "high_doctor_specialization_to_visit")
+
+# Fixed report strings: headings, field labels, results and the defaults of classify_against_reference
+REPORT_STRINGS = (
+    "Comprehensive Medical Test Report", "Health Risk Score Summary", "Care Guides",
+    "Patient Name", "Age", "Date", "Test", "Your Value", "Result", "Status", "Possible Diseases",
+    "Treatment Guide", "Suggested Doctor", "Time to Reach Normal Range", "Next Recommended Test Date",
+    "Health Information", "Total Abnormal Results", "Health Status", "Your Health Insight",
+    "Low", "High", "Normal", "Unknown", "N/A", "Unknown error", "Unable to analyze. Reason:",
+    "No specific care guides available.", "Invalid test or range values.",
+    "No additional health information available.", "Low values may indicate an issue.",
+    "High values may indicate an issue.", "Consult a doctor for further evaluation.", "Within healthy range.",
+    "No treatment required.", "Test result is within the normal range.",
+    "Unable to estimate time-to-normal due to insufficient data.", "General Physician",
+    "No immediate concern, retest in 90 days.", "Trending poorly — retest in 14 days.",
+    "Critical — immediate consultation advised.",
+    "Low Risk (Healthy)", "Moderate Risk (Needs Attention)", "High Risk (Critical Condition)",
+)
+
+SENTENCE_TEMPLATES = {
+    "Time Low": TIME_TO_NORMAL_LOW,
+    "Time High": TIME_TO_NORMAL_HIGH,
+    "Health Good": HEALTH_MESSAGE_GOOD,
+    "Health Follow Up": HEALTH_MESSAGE_FOLLOW_UP,
+    "Health Critical": HEALTH_MESSAGE_CRITICAL,
+}
+
+# Placeholders are sent to the translator as numbers, which it leaves untouched
+_SENTINELS = {"time": "7351", "score": "86.29"}
+
+# Arabic counted nouns: (one, two, 3-10, 11 and more)
+_ARABIC_DAYS = ("يوم واحد", "يومين", "أيام", "يومًا")
+_ARABIC_MONTHS = ("شهر واحد", "شهرين", "أشهر", "شهرًا")
+
+_DURATION = re.compile(r"^(?:(\d+) months?)?(?: and )?(?:(\d+) days?)?$")
+_ARABIC_CHARS = re.compile(r"[\u0600-\u06FF]")
+
+
+def _arabic_count(n, forms):
+    one, two, few, many = forms
+    if n == 1:
+        return one
+    if n == 2:
+        return two
+    return f"{n} {few if 3 <= n % 100 <= 10 else many}"
+
+
+def arabic_duration(days):
+    """
+    Returns the Arabic form of `format_duration(days)`.
+    """
+    months, days = divmod(days, 30) if days >= 30 else (0, days)
+    parts = []
+    if months:
+        parts.append(_arabic_count(months, _ARABIC_MONTHS))
+    if days:
+        parts.append(_arabic_count(days, _ARABIC_DAYS))
+    return " و".join(parts)
+
+
+def _template_sentences():
+    """
+    Yields (template key, English sentence, placeholder value) for every sentence the report
+    can print within TEMPLATE_MAX_MONTHS and TEMPLATE_MAX_TESTS.
+    """
+    for days in range(3, 30 * (TEMPLATE_MAX_MONTHS + 1)):
+        text = format_duration(days)
+        yield "Time Low", TIME_TO_NORMAL_LOW.format(time=text), days
+        yield "Time High", TIME_TO_NORMAL_HIGH.format(time=text), days
+
+    keys = {HEALTH_MESSAGE_GOOD: "Health Good", HEALTH_MESSAGE_FOLLOW_UP: "Health Follow Up",
+            HEALTH_MESSAGE_CRITICAL: "Health Critical"}
+    scores = set()
+    for tests in range(1, TEMPLATE_MAX_TESTS + 1):
+        for points in range(0, 2 * tests + 1):
+            scores.add(round(100 - (points / (2 * tests)) * 100, 2))
+    for score in sorted(scores):
+        _, message = health_summary(score)
+        for template, key in keys.items():
+            if template.format(score=score) == message:
+                yield key, message, score
+
+
+def _fill_template(template, key, value):
+    # Translated templates hold the placeholder as "{time}" / "{score}"
+    if key.startswith("Time"):
+        return template.replace("{time}", arabic_duration(value))
+    return template.replace("{score}", str(value))
+
+
+def _match_template(text):
+    """
+    Returns (template key, placeholder value) if `text` is a templated sentence, else None.
+    """
+    for key, template in SENTENCE_TEMPLATES.items():
+        placeholder = "{time}" if key.startswith("Time") else "{score}"
+        prefix, suffix = template.split(placeholder)
+        if not (text.startswith(prefix) and text.endswith(suffix)) or len(text) <= len(prefix) + len(suffix):
+            continue
+        value = text[len(prefix):len(text) - len(suffix)]
+        if placeholder == "{score}":
+            try:
+                return key, float(value)
+            except ValueError:
+                continue
+        match = _DURATION.match(value)
+        if match and any(match.groups()):
+            return key, int(match.group(1) or 0) * 30 + int(match.group(2) or 0)
+    return None
+
+
+def _default_font_path():
+    spec = importlib.util.find_spec("matplotlib")
+    if spec is None or not spec.submodule_search_locations:
+        return None
+    return os.path.join(spec.submodule_search_locations[0], "mpl-data", "fonts", "ttf", "DejaVuSans.ttf")
+
+
+_font_lock = threading.Lock()
+
+
+def register_report_font(path=None):
+    """
+    Registers the TTF font used for Arabic report text with ReportLab (once) and returns its name.
+    """
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+
+    with _font_lock:
+        if REPORT_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(REPORT_FONT_NAME, path or ARABIC_FONT_PATH or _default_font_path()))
+    return REPORT_FONT_NAME
+
+
+def _shaper():
+    import arabic_reshaper
+    from bidi.algorithm import get_display
+
+    return arabic_reshaper.reshape, get_display
+
+
+def _display_lines(text, reshape, get_display, width=REPORT_TEXT_WIDTH):
+    """
+    Shapes Arabic text and wraps it into lines of at most `width` points, each in visual
+    (left-to-right storage) order. Wrapping comes first, so lines read top to bottom.
+    """
+    from reportlab.lib.utils import simpleSplit
+
+    lines = simpleSplit(reshape(text), REPORT_FONT_NAME, REPORT_FONT_SIZE, width) or [""]
+    return [get_display(line, base_dir="R") for line in lines]
+
+
+def _google_translate(texts, language):
+    from googletrans import Translator
+
+    translator = Translator()
+    translated = []
+    for start in range(0, len(texts), TRANSLATE_BATCH_SIZE):
+        batch = texts[start:start + TRANSLATE_BATCH_SIZE]
+        for attempt in range(TRANSLATE_RETRIES):
+            try:
+                translated.extend(result.text for result in translator.translate(batch, src="en", dest=language))
+                break
+            except Exception as e:
+                if attempt == TRANSLATE_RETRIES - 1:
+                    raise
+                warn(f"Translation request failed ({e}); retrying.")
+                time.sleep(2 ** attempt)
+    return translated
+
+
+def report_text_sources(catalogue):
+    """
+    Returns every English string an Arabic report may print, apart from the templated sentences:
+    REPORT_STRINGS, the test names and the catalogue text fields, without duplicates.
+    """
+    sources = dict.fromkeys(REPORT_STRINGS)
+    for test_name, test_info in catalogue.items():
+        sources[test_name] = None
+        for field in CATALOGUE_TEXT_FIELDS:
+            value = (test_info or {}).get(field)
+            if isinstance(value, str) and value.strip():
+                sources[value] = None
+    return list(sources)
+
+
+def translation_cache_path(language, reference_version, directory=None):
+    return os.path.join(directory or TRANSLATION_CACHE_DIR, f"report_text_{language}_{reference_version[:16]}.json")
+
+
+def _read_cache_file(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if data.get("Format") == TRANSLATION_FORMAT_VERSION else None
+
+
+def build_translation_cache(language="ar", directory=None, translate=None):
+    """
+    Offline build step for translated reports: translates every reference-catalogue and report
+    string, shapes and bidi-orders it, wraps it for the report layout and writes the result to
+    a JSON file named after the language and the catalogue version.
+
+    Translations found in earlier cache files of the language are reused, so after a catalogue
+    edit only new or changed strings are sent to the translator. The templated sentences
+    (time-to-normal, health summary) are translated once as templates and rendered for every
+    duration and score in range, so no report needs the network.
+
+    Parameters:
+    language (str): Target language (only "ar" has the shaping and duration rules).
+    directory (str): Cache directory; defaults to TRANSLATION_CACHE_DIR.
+    translate (callable): translate(list of English strings, language) -> translated strings;
+    defaults to googletrans.
+
+    Returns:
+    dict: Cache path and counts of cached, translated and reused strings.
+    """
+    if language != "ar":
+        raise ValueError(f"Unsupported report language: {language}")
+    translate = translate or _google_translate
+    directory = directory or TRANSLATION_CACHE_DIR
+    started = time.perf_counter()
+
+    version = reference_store.version()
+    catalogue = {name: reference_store.get(name) for name in reference_store.test_names()}
+    sources = report_text_sources(catalogue)
+
+    known, known_templates = {}, {}
+    for path in glob.glob(os.path.join(directory, f"report_text_{language}_*.json")):
+        data = _read_cache_file(path)
+        if data is not None:
+            known.update((english, entry[0]) for english, entry in data["Strings"].items())
+            known_templates.update(data.get("Template Sources", {}))
+
+    missing = [text for text in sources if text not in known]
+    sentinel_templates = {key: template.replace("{time}", _SENTINELS["time"]).replace("{score}", _SENTINELS["score"])
+                          for key, template in SENTENCE_TEMPLATES.items()}
+    missing_templates = [key for key in SENTENCE_TEMPLATES if known_templates.get(key, [None])[0] != SENTENCE_TEMPLATES[key]]
+    with timed("translation_fetch"):
+        translated = translate(missing + [sentinel_templates[key] for key in missing_templates], language) \
+            if missing or missing_templates else []
+    known.update(zip(missing, translated))
+
+    for key, text in zip(missing_templates, translated[len(missing):]):
+        placeholder = "time" if key.startswith("Time") else "score"
+        if _SENTINELS[placeholder] not in text:
+            warn(f"Translation of the '{key}' template lost its placeholder; the English sentence is kept.",
+                 once=True)
+            continue
+        known_templates[key] = [SENTENCE_TEMPLATES[key], text.replace(_SENTINELS[placeholder], "{" + placeholder + "}")]
+
+    register_report_font()
+    reshape, get_display = _shaper()
+    strings = {}
+    with timed("translation_shape"):
+        for english in sources:
+            strings[english] = [known[english], _display_lines(known[english], reshape, get_display)]
+        templates = {key: arabic for key, (english, arabic) in known_templates.items() if key in SENTENCE_TEMPLATES}
+        for key, english, value in _template_sentences():
+            if key in templates:
+                arabic = _fill_template(templates[key], key, value)
+                strings[english] = [arabic, _display_lines(arabic, reshape, get_display)]
+
+    data = {
+        "Format": TRANSLATION_FORMAT_VERSION,
+        "Language": language,
+        "Reference": version,
+        "Built": datetime.now(timezone.utc).isoformat(),
+        "Layout": [REPORT_FONT_SIZE, REPORT_TEXT_WIDTH],
+        "Template Sources": {key: known_templates[key] for key in templates},
+        "Strings": strings,
+    }
+    path = translation_cache_path(language, version, directory)
+    os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+    return {
+        "Path": path,
+        "Strings": len(strings),
+        "Translated": len(missing) + len(missing_templates),
+        "Reused": len(sources) - len(missing),
+        "Elapsed (s)": round(time.perf_counter() - started, 3),
+    }
+
+
+class ReportText:
+    """
+    Translated report text loaded from a cache built by `build_translation_cache`.
+
+    Lookups return the pre-shaped display lines of an English string. Templated sentences
+    outside the pre-rendered range are rendered from their translated template, and text that
+    needs no translation (e.g. patient names) is shaped locally; neither needs the network.
+    Strings missing from the cache are printed as they are.
+    """
+
+    def __init__(self, language, data):
+        self.language = language
+        self.version = f"{language}:{data['Built']}"
+        self.strings = {english: entry[1] for english, entry in data["Strings"].items()}
+        self.templates = {key: arabic for key, (_, arabic) in data.get("Template Sources", {}).items()}
+
+    def lines(self, text):
+        """
+        Returns the display lines of an English string.
+        """
+        text = str(text)
+        lines = self.strings.get(text)
+        if lines is not None:
+            return lines
+        match = _match_template(text)
+        if match is not None and match[0] in self.templates:
+            lines = self.shape(_fill_template(self.templates[match[0]], *match))
+            self.strings[text] = lines
+            return lines
+        count_event("translation_misses")
+        return self.shape(text)
+
+    def line(self, text):
+        return " ".join(self.lines(text))
+
+    def shape(self, text):
+        """
+        Shapes and wraps text that is not in the cache (left unchanged if it has no Arabic letters).
+        """
+        if not _ARABIC_CHARS.search(text):
+            return [text]
+        try:
+            reshape, get_display = _shaper()
+        except ImportError:
+            return [text]
+        return _display_lines(text, reshape, get_display)
+
+
+_report_texts = {}
+_report_texts_lock = threading.Lock()
+
+
+def get_report_text(language, directory=None):
+    """
+    Returns the ReportText of a language for the current reference catalogue (loaded once per
+    catalogue version), or None if its cache has not been built.
+    """
+    version = reference_store.version()
+    key = (language, directory, version)
+    with _report_texts_lock:
+        text = _report_texts.get(key)
+    if text is not None:
+        return text
+
+    data = _read_cache_file(translation_cache_path(language, version, directory))
+    if data is None or data.get("Reference") != version:
+        return None
+    if data.get("Layout") != [REPORT_FONT_SIZE, REPORT_TEXT_WIDTH]:
+        warn("The translation cache was built for another report layout; rebuild it.", once=True)
+        return None
+    register_report_font()
+    text = ReportText(language, data)
+    with _report_texts_lock:
+        _report_texts.clear()
+        _report_texts[key] = text
+    return text
@@ -0,0 +1,336 @@
+# Incremental Trend State
+
+import math
+
+import numpy as np
+import pandas as pd
+
+from .backend import get_backend
+from .history import invalidate_user_history, load_user_history
+from .monitoring import TREND_EWMA_HALFLIFE, TREND_WINDOW, label_trends, trend_features_batch
+from .reference import patient_demographics, reference_store
+
+# Per-result decay of the EWMA weights, as in `trend_features_batch`
+_EWMA_DECAY = 0.5 ** (1 / TREND_EWMA_HALFLIFE)
+
+
+def _to_day(date):
+    """
+    Normalizes a date (datetime, Timestamp or string) to a naive midnight Timestamp.
+    The trend state works at day resolution.
+    """
+    date_obj = pd.Timestamp(date)
+    if date_obj.tzinfo is not None:
+        date_obj = date_obj.tz_convert("UTC").tz_localize(None)
+    return date_obj.normalize()
+
+
+def update_trend_state(state, date, value):
+    """
+    Adds one result to a per-(user, test) trend state in O(TREND_WINDOW), independent of the
+    length of the history.
+
+    The state keeps the count, first date, the two most recent (date, value) pairs, the running
+    sums Σx, Σy, Σxy and Σx² of x = days since the first date (for the least-squares prediction),
+    the latest TREND_WINDOW results and the EWMA sums (for the windowed trend labels). Results
+    may arrive out of order: an earlier first date shifts the sums instead of rescanning the
+    history. The EWMA is exact unless a result older than the whole window arrives after the
+    window is full; `rebuild_trend_state` recomputes it. A value that is not a finite number
+    raises ValueError, as NaN would poison the running sums.
+
+    Parameters:
+    state (dict): Current state, or None for the first result of the test.
+    date: Date of the result.
+    value (float): Test value.
+
+    Returns:
+    dict: The updated state (a new dict, ready to store in Firestore).
+    """
+    date = _to_day(date)
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError(f"Invalid test value: {value}")
+
+    if not state:
+        return {
+            "count": 1,
+            "first_date": date.to_pydatetime(),
+            "last_date": date.to_pydatetime(),
+            "last_value": value,
+            "prev_date": None,
+            "prev_value": None,
+            "sum_x": 0.0,
+            "sum_y": value,
+            "sum_xy": 0.0,
+            "sum_xx": 0.0,
+            "window_dates": [date.to_pydatetime()],
+            "window_values": [value],
+            "ewma_sum": value,
+            "ewma_weight": 1.0,
+        }
+
+    state = dict(state)
+    n = state["count"]
+    window_dates, window_values = _state_window(state)
+    first_date = _to_day(state["first_date"])
+
+    # Re-base the sums when the new result predates the first one: x -> x + shift
+    if date < first_date:
+        shift = float((first_date - date).days)
+        state["sum_xx"] += 2 * shift * state["sum_x"] + n * shift * shift
+        state["sum_xy"] += shift * state["sum_y"]
+        state["sum_x"] += n * shift
+        state["first_date"] = date.to_pydatetime()
+        first_date = date
+
+    x = float((date - first_date).days)
+    state["count"] = n + 1
+    state["sum_x"] += x
+    state["sum_y"] += value
+    state["sum_xy"] += x * value
+    state["sum_xx"] += x * x
+
+    # Keep the latest two results (a later insert with an equal date counts as newer)
+    if date >= _to_day(state["last_date"]):
+        state["prev_date"], state["prev_value"] = state["last_date"], state["last_value"]
+        state["last_date"], state["last_value"] = date.to_pydatetime(), value
+    elif state["prev_date"] is None or date >= _to_day(state["prev_date"]):
+        state["prev_date"], state["prev_value"] = date.to_pydatetime(), value
+
+    # Window of the latest results in date order; `newer` results of it come after this one
+    newer = sum(1 for window_date in window_dates if window_date > date)
+    at = len(window_dates) - newer
+    window_dates.insert(at, date)
+    window_values.insert(at, value)
+    state["window_dates"] = [d.to_pydatetime() for d in window_dates[-TREND_WINDOW:]]
+    state["window_values"] = window_values[-TREND_WINDOW:]
+
+    # EWMA sums: every older result loses one decay step, the newer ones keep their weight
+    newer_values = window_values[at + 1:]
+    newer_sum = sum(v * _EWMA_DECAY ** k for k, v in enumerate(reversed(newer_values)))
+    newer_weight = sum(_EWMA_DECAY ** k for k in range(newer))
+    ewma_sum, ewma_weight = state.get("ewma_sum"), state.get("ewma_weight")
+    if ewma_sum is None:
+        ewma_sum, ewma_weight = state["sum_y"] - value, float(n)  # state stored before the EWMA was kept
+    state["ewma_sum"] = (ewma_sum - newer_sum) * _EWMA_DECAY + value * _EWMA_DECAY ** newer + newer_sum
+    state["ewma_weight"] = (ewma_weight - newer_weight) * _EWMA_DECAY + _EWMA_DECAY ** newer + newer_weight
+
+    return state
+
+
+def _state_window(state):
+    """
+    Returns the latest results kept in a state as ([Timestamp], [float]) in date order.
+    States stored before the window was kept fall back to the two latest results.
+    """
+    if state.get("window_dates"):
+        return [_to_day(d) for d in state["window_dates"]], [float(v) for v in state["window_values"]]
+    pairs = [(state["prev_date"], state["prev_value"]), (state["last_date"], state["last_value"])]
+    pairs = [(_to_day(d), float(v)) for d, v in pairs if d is not None]
+    return [d for d, _ in pairs], [v for _, v in pairs]
+
+
+def _state_from_series(dates, values):
+    """
+    Builds the trend state of a date-sorted series in one vectorized pass: the state that
+    `update_trend_state` reaches when the results are added in this order.
+    """
+    days = pd.DatetimeIndex(dates).normalize()
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    x = (days - days[0]).days.to_numpy(dtype=float)
+    weights = _EWMA_DECAY ** np.arange(n - 1, -1, -1)
+    window = slice(max(n - TREND_WINDOW, 0), n)
+    return {
+        "count": n,
+        "first_date": days[0].to_pydatetime(),
+        "last_date": days[-1].to_pydatetime(),
+        "last_value": float(values[-1]),
+        "prev_date": days[-2].to_pydatetime() if n > 1 else None,
+        "prev_value": float(values[-2]) if n > 1 else None,
+        "sum_x": float(x.sum()),
+        "sum_y": float(values.sum()),
+        "sum_xy": float((x * values).sum()),
+        "sum_xx": float((x * x).sum()),
+        "window_dates": [date.to_pydatetime() for date in days[window]],
+        "window_values": values[window].tolist(),
+        "ewma_sum": float((weights * values).sum()),
+        "ewma_weight": float(weights.sum()),
+    }
+
+
+def predict_from_trend_state(state, horizon=30):
+    """
+    Returns the least-squares prediction `horizon` days after the latest result,
+    or None if the state has fewer than 2 results.
+    """
+    n = state["count"]
+    if n < 2:
+        return None
+    sum_x, sum_y = state["sum_x"], state["sum_y"]
+    sxx = n * state["sum_xx"] - sum_x * sum_x
+    slope = (n * state["sum_xy"] - sum_x * sum_y) / sxx if sxx > 0 else 0.0
+    intercept = (sum_y - slope * sum_x) / n
+    x_new = (_to_day(state["last_date"]) - _to_day(state["first_date"])).days + horizon
+    return intercept + slope * x_new
+
+
+def record_test_result(user_id, test_name, value, date):
+    """
+    Stores a new test result and updates the user's trend state for that test in the
+    same backend transaction. A value that is not a finite number raises ValueError and
+    nothing is stored.
+
+    Parameters:
+    user_id (str): ID of the user.
+    test_name (str): Name of the test.
+    value (float): Test value.
+    date: Date of the result (datetime or "YYYY-MM-DD").
+
+    Returns:
+    dict: The updated trend state.
+    """
+    if not math.isfinite(float(value)):
+        raise ValueError(f"Invalid test value: {value}")
+    result = {"test_name": test_name, "value": value, "date": date}
+    state = get_backend().add_test_result(user_id, result, lambda current: update_trend_state(current, date, value))
+    invalidate_user_history(user_id)
+    return state
+
+
+def rebuild_trend_state(user_id, history=None):
+    """
+    Recomputes and stores the trend state of every test from the user's full history.
+    Used to backfill existing patients; afterwards `record_test_result` keeps it current.
+
+    Returns:
+    dict: Test name -> trend state.
+    """
+    if history is None:
+        history = load_user_history(user_id, ttl=0)
+
+    states = {}
+    for test_name, (dates, values) in history.items():
+        # Non-finite values are rejected by `update_trend_state` and left out here
+        finite = np.isfinite(values)
+        if finite.any():
+            states[test_name] = _state_from_series(dates[finite], values[finite])
+
+    get_backend().set_trend_states(user_id, states)
+    return states
+
+
+def load_trend_state(user_id):
+    """
+    Reads the trend state of every test of a user (one small document per test).
+    """
+    return get_backend().get_trend_states(user_id)
+
+
+def analyze_trend_from_state(user_id, states=None, user_data=None):
+    """
+    Trend analysis from the stored trend state instead of the full history, in O(TREND_WINDOW)
+    per test. Uses the windowed metrics and `label_trends` of `analyze_trend_from_firestore`
+    on the latest TREND_WINDOW results and the stored EWMA.
+
+    The labels match `analyze_trend_from_firestore` except for the change point, which is
+    searched within the stored window only (the full series is not kept), so an older level
+    shift does not raise an out-of-range value to Critical. Only the previous value
+    ("Previous Value") is returned instead of every past value.
+
+    Parameters:
+    user_id (str): ID of the user.
+    states (dict): Optional pre-loaded trend states (see `load_trend_state`).
+    user_data (dict): Optional pre-loaded user profile, for demographic reference ranges.
+
+    Returns:
+    list: One dict per test with the trend status, monitoring priority and trend metrics.
+    """
+    if states is None:
+        states = load_trend_state(user_id)
+    if user_data is None and reference_store.has_demographic_ranges():
+        user_data = get_backend().get_user(user_id)
+    age, sex = patient_demographics(user_data)
+
+    test_names = list(states)
+    windows = [_state_window(states[test_name]) for test_name in test_names]
+    offsets = np.concatenate([[0], np.cumsum([len(dates) for dates, _ in windows])]).astype(np.int64)
+    days = np.array([(date - dates[0]).days for dates, _ in windows for date in dates], dtype=float)
+    values = np.array([value for _, window_values in windows for value in window_values], dtype=float)
+
+    ranges = [reference_store.get_range(test_name, age, sex) for test_name in test_names]
+    min_range = np.array([r[0] if r else np.nan for r in ranges], dtype=float)
+    max_range = np.array([r[1] if r else np.nan for r in ranges], dtype=float)
+
+    features = trend_features_batch(days, values, offsets)
+    features["Count"] = np.array([states[test_name]["count"] for test_name in test_names])
+    features["EWMA"] = np.array([_state_ewma(states[test_name]) for test_name in test_names], dtype=float)
+    trend_status, priority = label_trends(features, min_range, max_range)
+
+    results = []
+    for i, test_name in enumerate(test_names):
+        state = states[test_name]
+        current_value = state["last_value"]
+        if state["count"] < 2:
+            results.append({
+                "Test Name": test_name,
+                "Current Value": current_value,
+                "Trend Status": "No Historical Data"
+            })
+            continue
+
+        if ranges[i] is None:
+            continue
+
+        results.append({
+            "Test Name": test_name,
+            "Current Value": current_value,
+            "Previous Value": state["prev_value"],
+            "Trend Status": trend_status[i],
+            "Monitoring Priority": priority[i],
+            "Slope (per 30 Days)": round(float(features["Slope"][i]) * 30, 2),
+            "EWMA": round(float(features["EWMA"][i]), 2),
+            "Variability": None if np.isnan(features["Variability"][i]) else round(float(features["Variability"][i]), 2),
+            "Change Point": bool(features["Change Point"][i]),
+        })
+
+    return results
+
+
+def _state_ewma(state):
+    if state.get("ewma_weight"):
+        return state["ewma_sum"] / state["ewma_weight"]
+    return state["sum_y"] / state["count"]
+
+
+def predict_all_next_values_from_state(user_id, states=None, horizon=30):
+    """
+    O(1)-per-test version of `predict_all_next_values_from_firestore` using the stored sums.
+    """
+    if states is None:
+        states = load_trend_state(user_id)
+
+    results = []
+    for test_name, state in states.items():
+        if state["count"] < 2:
+            results.append({
+                "Test Name": test_name,
+                "Message": "Insufficient historical data for prediction (need at least 2 data points)."
+            })
+            continue
+
+        if reference_store.get(test_name) is None:
+            results.append({
+                "Test Name": test_name,
+                "Message": "Test not found in Firestore reference."
+            })
+            continue
+
+        predict_date = _to_day(state["last_date"]) + pd.Timedelta(days=horizon)
+        results.append({
+            "Test Name": test_name,
+            f"Predicted Value (Next {horizon} Days)": round(float(predict_from_trend_state(state, horizon)), 2),
+            "Prediction Date": predict_date.strftime('%Y-%m-%d')
+        })
+
+    return results